@@ -0,0 +1,158 @@
+#!/usr/bin/env python2.7
+import display_linky
+
+import argparse
+import gc
+import sys
+import timeit
+
+"""
+Benchmark of the TIC decoding pipeline, based on capture files
+
+Record a capture from a Linky meter (here in "TIC standard" mode, for 10 minutes):
+./bench_linky.py record --port /dev/ttyUSB0 --baudrate 9600 --duration 600 standard.cap
+
+Replay captures as fast as possible through TICLinkLayerDecoder, TICFrames and FixedWidthHistoryBarGraph:
+./bench_linky.py run --standard standard.cap --historique historique.cap
+"""
+
+HISTORY_LABEL = {True: 'SINSTS', False: 'PAPP'}	# The power label stored in the history graph, for each TIC mode
+
+def percentile(sorted_values, percent):
+	"""@brief Get a percentile of a list of values (nearest-rank method)
+
+	@param sorted_values The values, sorted in increasing order
+	@param percent The percentile to compute (0 to 100)
+	"""
+	if not sorted_values:
+		return None
+	rank = int(round(percent / 100.0 * len(sorted_values) + 0.5)) - 1
+	return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+class StageStats:
+	"""@brief Latency statistics for one stage of the decoding pipeline
+	"""
+	def __init__(self, name):
+		self.name = name
+		self.latencies = []
+
+	def add(self, duration):
+		self.latencies.append(duration)
+
+	def to_string(self):
+		latencies = sorted(self.latencies)
+		total = sum(latencies)
+		return '%-8s total=%8.3fs p50=%8.1fus p99=%8.1fus max=%8.1fus' % (self.name,
+		                                                                    total,
+		                                                                    percentile(latencies, 50) * 1e6,
+		                                                                    percentile(latencies, 99) * 1e6,
+		                                                                    latencies[-1] * 1e6)
+
+def run_benchmark(capture_path, standard_tic_mode, labels=None, repeat=1):
+	"""@brief Replay a capture file as fast as possible through the decoding pipeline, and print statistics
+
+	@param capture_path The capture file (recorded with PhyDecoder's capture_path parameter)
+	@param standard_tic_mode True if the capture contains "TIC standard" frames, False for "TIC historique"
+	@param labels An optional whitelist of labels passed to TICFrames
+	@param repeat The number of times the capture is replayed
+	"""
+	phy = display_linky.ReplayPhyDecoder(capture_path)
+	link_decoder = display_linky.TICLinkLayerDecoder(phy)
+	history_label = HISTORY_LABEL[standard_tic_mode]
+	if labels is not None and history_label not in labels:
+		labels = list(labels) + [history_label]
+	tic_frames = display_linky.TICFrames(tic_link_frame_fetcher=None, standard_tic_mode=standard_tic_mode, labels=labels)
+	history = display_linky.FixedWidthHistoryBarGraph(width=84, history_requested_size=60*15)
+	change_encoder = display_linky.TICChangeEncoder(snapshot_interval=float('inf'))	# Only the first frame is a snapshot
+	nb_values = 0
+	stages = [StageStats('link'), StageStats('decode'), StageStats('history'), StageStats('total')]
+	(link_stats, decode_stats, history_stats, total_stats) = stages
+	nb_frames = 0
+	nb_datasets = 0
+	nb_gc_objects = 0
+	timer = timeit.default_timer
+	gc.collect()
+	gc.disable()	# Garbage collections would add random pauses, and we use the collector counters to count allocations
+	try:
+		for _ in range(repeat):
+			phy.rewind()
+			start_time = timer()
+			last_frame_end = start_time
+			gc_count = gc.get_count()[0]
+			while not phy.eof:
+				for (buf, start, end) in link_decoder.iter_frame_spans():
+					frame_start = timer()
+					record = tic_frames.decode_frame(buf, start, end)
+					decode_end = timer()
+					history.append(record.get(history_label))
+					tuple(history.percent_bars)	# This is what is sent to the display for each frame
+					frame_end = timer()
+					link_stats.add(frame_start - last_frame_end)
+					decode_stats.add(decode_end - frame_start)
+					history_stats.add(frame_end - decode_end)
+					total_stats.add(frame_end - last_frame_end)
+					nb_gc_objects += gc.get_count()[0] - gc_count
+					nb_frames += 1
+					nb_datasets += buf.count(display_linky.TICDataSetExtractor.LF, start, end)	# Not timed
+					nb_values += len(record.items())
+					change_encoder.encode(record, timestamp=0)
+					last_frame_end = timer()
+					gc_count = gc.get_count()[0]
+	finally:
+		gc.enable()
+	duration = sum(total_stats.latencies)
+	print(capture_path + (' ("TIC standard")' if standard_tic_mode else ' ("TIC historique")'))
+	if nb_frames == 0:
+		print('  No frame found in capture')
+		return
+	print('  %d frames, %d datasets in %.3fs: %.1f frames/s, %.1f datasets/s' % (nb_frames, nb_datasets, duration, nb_frames / duration, nb_datasets / duration))
+	print('  %.1f gc-tracked objects allocated and still referenced per frame' % (float(nb_gc_objects) / nb_frames))	# Python 2.7 has no counter of all allocations, this shows retained containers
+	print('  %.1f values per frame, %.1f changed values per frame' % (float(nb_values) / nb_frames, float(change_encoder.nb_values_emitted) / nb_frames))
+	print('  %d datasets decoded, %d skipped, %d checksum errors, %d malformed' % (tic_frames.nb_datasets_decoded, tic_frames.nb_datasets_skipped, tic_frames.nb_checksum_errors, tic_frames.nb_malformed_datasets))
+	for stage in stages:
+		print('  ' + stage.to_string())
+
+def record_capture(port, baudrate, duration, capture_path):
+	"""@brief Record the bytes received on a serial port to a capture file
+
+	@param port The serial device to read from
+	@param baudrate The serial baudrate
+	@param duration The capture duration in seconds
+	@param capture_path The capture file to write to
+	"""
+	phy = display_linky.PhyDecoder(port=port, baudrate=baudrate, blocking=True, capture_path=capture_path)
+	link_decoder = display_linky.TICLinkLayerDecoder(phy)
+	end_time = timeit.default_timer() + duration
+	nb_frames = 0
+	while timeit.default_timer() < end_time:
+		link_decoder.get_next_frame()
+		nb_frames += 1
+	print('Recorded ' + str(nb_frames) + ' frames to ' + capture_path)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmark of the TIC decoding pipeline')
+	subparsers = parser.add_subparsers(dest='command')
+	record_parser = subparsers.add_parser('record', help='Record a capture file from a serial port')
+	record_parser.add_argument('--port', default='/dev/ttyUSB0', help='Serial device to read from')
+	record_parser.add_argument('--baudrate', type=int, default=9600, help='1200 for "TIC historique", 9600 for "TIC standard"')
+	record_parser.add_argument('--duration', type=float, default=600, help='Capture duration in seconds')
+	record_parser.add_argument('capture', help='Capture file to write to')
+	run_parser = subparsers.add_parser('run', help='Replay capture files through the decoding pipeline')
+	run_parser.add_argument('--standard', action='append', default=[], help='A "TIC standard" capture file')
+	run_parser.add_argument('--historique', action='append', default=[], help='A "TIC historique" capture file')
+	run_parser.add_argument('--labels', help='Comma-separated list of labels to decode (all labels by default)')
+	run_parser.add_argument('--repeat', type=int, default=1, help='Number of times each capture is replayed')
+	args = parser.parse_args()
+
+	if args.command == 'record':
+		record_capture(port=args.port, baudrate=args.baudrate, duration=args.duration, capture_path=args.capture)
+	else:
+		if not args.standard and not args.historique:
+			parser.error('at least one --standard or --historique capture file is required')
+		labels = None
+		if args.labels:
+			labels = args.labels.split(',')
+		for capture_path in args.standard:
+			run_benchmark(capture_path, standard_tic_mode=True, labels=labels, repeat=args.repeat)
+		for capture_path in args.historique:
+			run_benchmark(capture_path, standard_tic_mode=False, labels=labels, repeat=args.repeat)
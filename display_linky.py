@@ -1,38 +1,238 @@
 #!/usr/bin/env python2.7
-import Adafruit_Nokia_LCD as LCD
+try:
+	import Adafruit_Nokia_LCD as LCD
+except ImportError:	# Only required to drive the LCD, the TIC decoding classes can be used without it (eg: for benchmarks)
+	LCD = None
 
 from PIL import Image
 from PIL import ImageDraw
 from PIL import ImageFont
 
-import traceback
+import argparse
+import BaseHTTPServer
+import bisect
+import json
+import mmap
+import multiprocessing
+import os
+import select
 import serial
+import SocketServer
+import struct
 import threading
-import Queue
 import time
+import timeit
 import datetime
+import collections
+import io
 
 """
 Sample use as a Linky decoding library
 import display_linky	# Import the library
-s=display_linky.PhyDecoder(baudrate=9600, port="/dev/ttyUSB0")	# Enable the TIC phy decoder on serial port ttyUSB0 at baudrate 9600 ("TIC historique")
+s=display_linky.PhyDecoder(baudrate=9600, port="/dev/ttyUSB0", blocking=True)	# Enable the TIC phy decoder on serial port ttyUSB0 at baudrate 9600 ("TIC standard"), waking up only when bytes are received
 l=display_linky.TICLinkLayerDecoder(s)	# Create a Link layer decoder, fetching raw data from the previous PhyDecoder
-tf=display_linky.TICFrames(l,standard_tic_mode=True)	# Create a TIC frame parser
+tf=display_linky.TICFrames(l.get_next_frame,standard_tic_mode=True)	# Create a TIC frame parser
 for frame in tf:	# Forever loop returning each new frame as it is ready from the serial port
  print(frame)
+ print(frame.get('SINSTS'))	# Values are typed according to TICSchema (here, an int), None when missing
 
+Sample use with several consumers in a single thread
+p=display_linky.TICPipeline(display_linky.TICLinkLayerDecoder(display_linky.PhyDecoder(baudrate=9600, port="/dev/ttyUSB0")), display_linky.TICFrames(None, standard_tic_mode=True))
+def printer(item):	# Each item is a tuple (reception time, frame)
+ print(item[1])
+p.add_consumer('printer', callback=printer, maxlen=8)	# At most 8 frames are kept if the printer is late
+p.run()	# Forever loop decoding frames and running consumers
+
+Sample use receiving only the labels that changed since the previous frame
+def change_printer(event):	# Each event is a tuple (sequence number, reception time, snapshot, changes)
+ print(event[3])	# A tuple of (label, value) pairs, all labels when event[2] is True (a full snapshot is sent every 60s here)
+p.add_change_consumer('changes', callback=change_printer, maxlen=8, snapshot_interval=60)	# Use TICChangeDecoder.apply() to rebuild full frames from events
+p.run()
+
+Sample use with several meters
+r=display_linky.MultiMeterReader()	# Pass nb_decoding_processes=N to decode frames in a pool of N processes
+r.add_meter('home', display_linky.PhyDecoder(baudrate=9600, port="/dev/ttyUSB0"), standard_tic_mode=True)
+r.add_meter('garage', display_linky.PhyDecoder(baudrate=1200, port="/dev/ttyUSB1"), standard_tic_mode=False)
+for (meter_id, timestamp, frame) in r:	# Forever loop returning frames from any meter
+ print(meter_id + ': ' + str(frame))
+print(r.get_stats())	# Per-meter frame and error counters
 """
 
-class TerminalColor:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKCYAN = '\033[96m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
+class RateLimitedLog:
+	"""@brief Structured console log (one "key=value" line per event), printing each event at most once per interval
+
+	Occurrences of an event within the interval are only counted, and the count is printed with the next occurrence.
+	"""
+	def __init__(self, min_interval=10):
+		"""@brief Constructor
+
+		@param min_interval The minimum time (in seconds) between two printed occurrences of the same event
+		"""
+		self.min_interval = min_interval
+		self._events = {}	# For each event, a list [last print time, number of suppressed occurrences since]
+
+	def emit(self, level, event, min_interval=None, **fields):
+		"""@brief Log one occurrence of an event
+
+		@param level The severity (eg: 'INFO', 'WARNING', 'ERROR')
+		@param event The event name, occurrences of the same event are rate-limited together
+		@param min_interval An optional override of the minimum interval for this event
+		@param fields Values to print with the event
+		@return True if the event was printed, False if it was suppressed
+		"""
+		now = time.time()
+		if min_interval is None:
+			min_interval = self.min_interval
+		state = self._events.get(event)
+		if state is not None and now - state[0] < min_interval:
+			state[1] += 1
+			return False
+		line = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now)) + ' ' + level + ' event=' + event
+		for (name, value) in sorted(fields.items()):
+			line += ' ' + name + '=' + str(value)
+		if state is not None and state[1]:
+			line += ' suppressed=' + str(state[1])
+		print(line)
+		self._events[event] = [now, 0]
+		return True
+
+log = RateLimitedLog()	# Log used by this module
+
+class Histogram:
+	"""@brief Distribution of measurements (eg: durations in seconds), counted in fixed buckets so that observing a value is cheap
+	"""
+	DEFAULT_BOUNDS = tuple(10 ** (exponent / 4.0) for exponent in range(-24, 5))	# From 1us to 10s, 4 buckets per decade
+
+	def __init__(self, bounds=DEFAULT_BOUNDS):
+		"""@brief Constructor
+
+		@param bounds The sorted upper bounds of the buckets (an extra bucket counts values above the last bound)
+		"""
+		self.bounds = tuple(bounds)
+		self.bucket_counts = [0] * (len(self.bounds) + 1)
+		self.count = 0
+		self.total = 0
+		self.maximum = None
+
+	def observe(self, value):
+		self.bucket_counts[bisect.bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.total += value
+		if self.maximum is None or value > self.maximum:
+			self.maximum = value
+
+	def get_percentile(self, percent):
+		"""@brief Estimate a percentile of the observed values
+
+		@param percent The percentile to compute (0 to 100)
+		@return The upper bound of the bucket containing the percentile (or the maximum value if it is lower), or None if nothing was observed
+		"""
+		if self.count == 0:
+			return None
+		rank = max(1, int(round(percent / 100.0 * self.count)))
+		cumulated = 0
+		for (pos, bucket_count) in enumerate(self.bucket_counts):
+			cumulated += bucket_count
+			if cumulated >= rank:
+				break
+		if pos == len(self.bounds):
+			return self.maximum
+		return min(self.bounds[pos], self.maximum)
+
+class MetricsRegistry:
+	"""@brief Registry of named metrics: counters, gauges (read from a function when reported) and histograms
+	"""
+	def __init__(self):
+		self.counters = collections.OrderedDict()	# Counter values, indexed by name (increment them directly, eg: registry.counters['x'] += 1)
+		self.gauges = collections.OrderedDict()	# Functions returning the current value, indexed by name
+		self.histograms = collections.OrderedDict()	# Histograms, indexed by name
+
+	def add_counter(self, name):
+		self.counters.setdefault(name, 0)
+
+	def add_gauge(self, name, function):
+		"""@brief Register a value computed when metrics are reported (eg: a counter maintained by another object)
+		"""
+		self.gauges[name] = function
+
+	def add_histogram(self, name, bounds=Histogram.DEFAULT_BOUNDS):
+		"""@return The histogram with this name (it is created if needed)
+		"""
+		histogram = self.histograms.get(name)
+		if histogram is None:
+			histogram = Histogram(bounds)
+			self.histograms[name] = histogram
+		return histogram
+
+	def get_values(self):
+		"""@return An OrderedDict of all current values, histograms being summarized by their count, p50, p99 and max
+		"""
+		values = collections.OrderedDict(self.counters)
+		for (name, function) in self.gauges.items():
+			values[name] = function()
+		for (name, histogram) in self.histograms.items():
+			values[name + '_count'] = histogram.count
+			values[name + '_p50'] = histogram.get_percentile(50)
+			values[name + '_p99'] = histogram.get_percentile(99)
+			values[name + '_max'] = histogram.maximum
+		return values
+
+	def to_text(self):
+		"""@return All metrics in a text format, one "name value" line per metric, histograms being exposed with their cumulative buckets
+		"""
+		lines = []
+		for (name, value) in self.counters.items():
+			lines.append(name + ' ' + str(value))
+		for (name, function) in self.gauges.items():
+			lines.append(name + ' ' + str(function()))
+		for (name, histogram) in self.histograms.items():
+			cumulated = 0
+			for (bound, bucket_count) in zip(histogram.bounds, histogram.bucket_counts):
+				cumulated += bucket_count
+				lines.append(name + '_bucket{le="%g"} %d' % (bound, cumulated))
+			lines.append(name + '_bucket{le="+Inf"} ' + str(histogram.count))
+			lines.append(name + '_sum ' + repr(histogram.total))
+			lines.append(name + '_count ' + str(histogram.count))
+		return '\n'.join(lines) + '\n'
+
+class MetricsHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	"""@brief HTTP server publishing a MetricsRegistry as text on any GET request
+
+	Requests are served in their own threads (see start()), so that a slow client never holds up decoding.
+	Metrics are only read from these threads, the registry values being updated by the decoding thread.
+	"""
+	daemon_threads = True	# Pending requests do not prevent exiting
+
+	class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+		timeout = 2	# Idle clients do not keep their thread forever
+
+		def do_GET(self):
+			body = self.server.registry.to_text().encode('ascii')
+			self.send_response(200)
+			self.send_header('Content-Type', 'text/plain; version=0.0.4')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass	# No console output for each request
+
+	def __init__(self, registry, port=8042, address='127.0.0.1'):
+		"""@brief Listen for HTTP requests
+
+		@param registry The MetricsRegistry to publish
+		@param port The TCP port to listen on
+		@param address The address to listen on (local only by default)
+		"""
+		BaseHTTPServer.HTTPServer.__init__(self, (address, port), MetricsHTTPServer.RequestHandler)
+		self.registry = registry
+
+	def start(self):
+		"""@brief Serve requests in a background thread
+		"""
+		thread = threading.Thread(target=self.serve_forever, name='metrics-http')
+		thread.daemon = True
+		thread.start()
 
 class PhyDecoder:
 	"""@brief TIC physical layer decoder, based on a Linux serial port connection
@@ -41,34 +241,184 @@ class PhyDecoder:
 	DEFAULT_BITS_PER_SYMBOL = serial.SEVENBITS
 	DEFAULT_PARITY = serial.PARITY_EVEN
 	DEFAULT_STOP_BITS = serial.STOPBITS_ONE
+	DEFAULT_INTER_BYTE_TIMEOUT = 0.1
+	CAPTURE_RECORD_HEADER = struct.Struct('<dI')	# Each chunk in a capture file is preceeded by its reception time (in seconds since epoch) and its length
 
 	def __init__(self,
 	             port,
 	             baudrate=DEFAULT_BAUDRATE,
 	             bits_per_symbol=DEFAULT_BITS_PER_SYMBOL,
 	             parity=DEFAULT_PARITY,
-	             stop_bits=DEFAULT_STOP_BITS):
+	             stop_bits=DEFAULT_STOP_BITS,
+	             blocking=False,
+	             inter_byte_timeout=DEFAULT_INTER_BYTE_TIMEOUT,
+	             capture_path=None):
+		"""@brief Open the serial port carrying the TIC signal
+
+		@param port The serial device to read from (eg: "/dev/ttyUSB0")
+		@param baudrate The serial baudrate (1200 for "TIC historique", 9600 for "TIC standard")
+		@param bits_per_symbol The number of data bits per symbol
+		@param parity The serial parity
+		@param stop_bits The number of stop bits
+		@param blocking If True, get_next_incoming_bytes() sleeps (using poll()) until bytes are received, instead of returning immediately what is already buffered
+		@param inter_byte_timeout In blocking mode, the maximum silence (in seconds) on the line once reception has started, after which we return what we have received so far
+		@param capture_path An optional file to which all received bytes are appended, with their reception time (it can later be replayed with ReplayPhyDecoder)
+		"""
+		self._serial_port = None
+		self._capture_file = None
 		self._serial_port = serial.Serial(port=port,
 		                                  baudrate=baudrate,
 		                                  parity=parity,
 		                                  stopbits=stop_bits,
 		                                  bytesize=bits_per_symbol)
+		self.baudrate = baudrate
+		self.blocking = blocking
+		self.inter_byte_timeout = inter_byte_timeout
+		if self.blocking:
+			self._poller = select.poll()
+			self._poller.register(self._serial_port.fileno(), select.POLLIN)
+		else:
+			self._poller = None
+		if capture_path is not None:
+			self._capture_file = open(capture_path, 'ab')
 
 	def __del__(self):
 		if self._serial_port is not None:
 			if self._serial_port.is_open:
 				self._serial_port.close()
 				self._serial_port = None
+		if self._capture_file is not None:
+			self._capture_file.close()
+			self._capture_file = None
 
-	def get_next_incoming_bytes(self):
+	def fileno(self):
+		"""@brief Get the file descriptor of the serial port, to wait for incoming bytes with select() or poll()
+		"""
+		return self._serial_port.fileno()
+
+	def set_baudrate(self, baudrate):
+		"""@brief Change the serial baudrate, discarding the bytes received so far
+		"""
+		self._serial_port.baudrate = baudrate
+		self._serial_port.reset_input_buffer()
+		self.baudrate = baudrate
+
+	def _capture(self, data):
+		"""@brief Append received bytes to the capture file (if any)
+		"""
+		if self._capture_file is not None and data:
+			self._capture_file.write(self.CAPTURE_RECORD_HEADER.pack(time.time(), len(data)))
+			self._capture_file.write(data)
+
+	def _wait_readable(self, timeout):
+		"""@brief Sleep until bytes are available on the serial port
+
+		@param timeout The maximum time to wait (in seconds), or None to wait forever
+		@return True if bytes are ready to be read, False if the timeout expired
+		"""
+		if timeout is None:
+			events = self._poller.poll()
+		else:
+			events = self._poller.poll(timeout * 1000)
+		return len(events) > 0
+
+	def get_next_incoming_bytes(self, terminator=None):
+		"""@brief Get the next bytes received on the serial port
+
+		@param terminator In blocking mode, a byte after which we return immediately instead of waiting for the inter-byte timeout (eg: the end of frame marker)
+		@return The bytes received (in non-blocking mode, this may be empty)
+		"""
 		assert self._serial_port is not None
-		return self._serial_port.read_all()
+		if not self.blocking:
+			received = self._serial_port.read_all()
+			self._capture(received)
+			return received
+		received = []
+		timeout = None	# Wait as long as required for the first byte
+		while self._wait_readable(timeout):
+			chunk = self._serial_port.read(max(1, self._serial_port.in_waiting))
+			received.append(chunk)
+			if terminator is not None and terminator in chunk:
+				break
+			timeout = self.inter_byte_timeout	# Reception has started, now only wait for the following bytes
+		received = b''.join(received)
+		self._capture(received)
+		return received
+
+class ReplayPhyDecoder(PhyDecoder):
+	"""@brief TIC physical layer decoder replaying a capture file recorded by PhyDecoder (see its capture_path parameter)
+	"""
+	def __init__(self, capture_path, realtime=False, blocking=False):
+		"""@brief Load a capture file
+
+		@param capture_path The capture file to replay
+		@param realtime If True, chunks are returned at the pace they were received, otherwise as fast as possible
+		@param blocking If True, get_next_incoming_bytes() raises EOFError at the end of the capture, otherwise it returns empty buffers
+		"""
+		self._serial_port = None
+		self._capture_file = None
+		self.baudrate = None
+		self.blocking = blocking
+		self.realtime = realtime
+		self.chunks = []	# List of tuples (reception time, bytes)
+		header_size = self.CAPTURE_RECORD_HEADER.size
+		with open(capture_path, 'rb') as capture_file:
+			content = capture_file.read()
+		pos = 0
+		while pos + header_size <= len(content):
+			(timestamp, length) = self.CAPTURE_RECORD_HEADER.unpack_from(content, pos)
+			pos += header_size
+			self.chunks.append((timestamp, content[pos:pos+length]))
+			pos += length
+		self.rewind()
+
+	def fileno(self):
+		"""@brief There is no file descriptor to wait on when replaying a capture, bytes are always ready until the end of the capture
+		"""
+		return None
+
+	def set_baudrate(self, baudrate):
+		"""@brief The baudrate of a capture cannot be changed, it is only recorded
+		"""
+		self.baudrate = baudrate
+
+	def rewind(self):
+		"""@brief Restart the replay from the beginning of the capture
+		"""
+		self._next_chunk = 0
+		self._replay_start_time = None
+		self.eof = (len(self.chunks) == 0)
+
+	def get_next_incoming_bytes(self, terminator=None):
+		"""@brief Get the next chunk from the capture
+
+		@param terminator Unused, chunks are returned as they were received
+		@return The bytes of the chunk (empty at the end of the capture in non-blocking mode)
+		"""
+		if self._next_chunk >= len(self.chunks):
+			self.eof = True
+			if self.blocking:
+				raise EOFError('End of TIC capture')
+			return b''
+		(timestamp, data) = self.chunks[self._next_chunk]
+		self._next_chunk += 1
+		if self.realtime:
+			if self._replay_start_time is None:
+				self._replay_start_time = time.time() - (timestamp - self.chunks[0][0])
+			delay = self._replay_start_time + (timestamp - self.chunks[0][0]) - time.time()
+			if delay > 0:
+				time.sleep(delay)
+		self.eof = (self._next_chunk >= len(self.chunks))
+		return data
 
 class TICLinkLayerDecoder:
 	"""@brief TIC Link layer decoder
+
+	Incoming bytes are accumulated in a reusable bytearray, that is scanned only once: we remember where the previous scan stopped.
+	Frames are handed out as memoryview slices of this buffer, or as (buffer, start, end) spans (see iter_frame_spans()), without any copy. They are only valid until the next read from the PhyDecoder.
 	"""
-	STX_BYTE = '\x02'
-	ETX_BYTE = '\x03'
+	STX_BYTE = b'\x02'
+	ETX_BYTE = b'\x03'
 
 	def __init__(self, phy_decoder):
 		"""@brief TIC Link kayer decoder
@@ -77,126 +427,1167 @@ class TICLinkLayerDecoder:
 		"""
 		assert isinstance(phy_decoder, PhyDecoder)
 		self._phy_decoder = phy_decoder
+		self.reset()
+		self.nb_resyncs = 0	# Number of times we lost synchronization after the first frame
+
+	def reset(self):
+		"""@brief Forget the bytes received so far, and wait for a new first frame (eg: after a baudrate change)
+		"""
 		self.initial_frame_sync = False
-		self.incoming_buffer = ''
+		self.incoming_buffer = bytearray()	# A new buffer, frames handed out earlier remain valid
+		self._consumed = 0	# Bytes before this position have been processed, they will be discarded at the next read
+		self._scan_pos = 0	# Position from which we continue searching for the next STX or ETX marker
+		self._frame_start = -1	# Position of the STX marker of the frame being received, or -1 if we are waiting for a STX
+		self._skipped_bytes = 0	# Number of garbage bytes discarded while waiting for a STX
 
-	def get_next_frame(self):
-		self.incoming_buffer += self._phy_decoder.get_next_incoming_bytes()
-		stx_pos = self.incoming_buffer.find(self.STX_BYTE)
-		if stx_pos == -1:
-			return None	# No sync
-		else:
-			if stx_pos != 0:
-				self.incoming_buffer = self.incoming_buffer[stx_pos:]	# Keep only buffer from STX byte
+	def _feed(self, data):
+		"""@brief Append newly received bytes to our internal buffer, discarding the bytes already processed
+
+		@param data The new bytes
+		"""
+		consumed = self._consumed
+		try:
+			if consumed:
+				del self.incoming_buffer[:consumed]
+			self.incoming_buffer += data
+		except BufferError:	# A frame handed out earlier is still referenced, leave the old buffer to its owner
+			self.incoming_buffer = self.incoming_buffer[consumed:]
+			self.incoming_buffer += data
+		self._consumed = 0
+		self._scan_pos -= consumed
+		if self._frame_start != -1:
+			self._frame_start -= consumed
+
+	def _extract_frame(self):
+		"""@brief Extract the next complete frame from our internal buffer
+
+		@return The frame payload (without STX and ETX bytes) as a memoryview, or None if no full frame is available yet
+		"""
+		span = self._extract_frame_span()
+		if span is None:
+			return None
+		return memoryview(self.incoming_buffer)[span[0]:span[1]]
+
+	def _extract_frame_span(self):
+		"""@brief Locate the next complete frame in our internal buffer, and move past it
+
+		@return A tuple (start, end) containing the offsets of the frame payload (without STX and ETX bytes) in self.incoming_buffer, or None if no full frame is available yet
+		"""
+		buf = self.incoming_buffer
+		if self._frame_start == -1:	# We are waiting for the start of a frame
+			stx_pos = buf.find(self.STX_BYTE, self._scan_pos)
+			if stx_pos == -1:
+				self._skipped_bytes += len(buf) - self._consumed
+				self._consumed = self._scan_pos = len(buf)	# No sync, everything we have is garbage
+				return None
+			self._skipped_bytes += stx_pos - self._consumed
+			if self._skipped_bytes != 0:
 				if self.initial_frame_sync:
-					print('Warning: Lost synchronization')
+					self.nb_resyncs += 1
+					log.emit('WARNING', 'lost_sync', nb_resyncs=self.nb_resyncs)
+				self._skipped_bytes = 0
 			self.initial_frame_sync = True	# We are now in sync
-		etx_pos = self.incoming_buffer.find(self.ETX_BYTE)
+			self._frame_start = stx_pos
+			self._scan_pos = stx_pos + 1
+		etx_pos = buf.find(self.ETX_BYTE, self._scan_pos)
 		if etx_pos == -1:
-			return ''	# No full frame yet
-		else:
-			one_frame_buffer = self.incoming_buffer[1:etx_pos]	# We get rid of STX and ETX chars, this is our next frame
-			self.incoming_buffer = self.incoming_buffer[etx_pos+1:]	# Keep in our internal buffer only the bytes after ETX
-			return one_frame_buffer
+			self._scan_pos = len(buf)	# No full frame yet, next scan will only process new bytes
+			return None
+		restart_pos = buf.rfind(self.STX_BYTE, self._frame_start+1, etx_pos)
+		if restart_pos != -1:	# The previous frame was truncated (its ETX was lost), only keep the last one
+			self.nb_resyncs += 1
+			log.emit('WARNING', 'lost_sync', nb_resyncs=self.nb_resyncs)
+			self._frame_start = restart_pos
+		span = (self._frame_start+1, etx_pos)	# We get rid of STX and ETX chars, this is our next frame
+		self._frame_start = -1
+		self._consumed = self._scan_pos = etx_pos + 1	# Only the bytes after ETX are still of interest
+		return span
+
+	def get_next_frame(self):
+		"""@brief Get the next TIC frame
+
+		If the underlying PhyDecoder is blocking, this method sleeps until a full frame has been received.
+		Otherwise, it only processes the bytes already received and returns immediately.
+
+		@return The frame payload (without STX and ETX bytes) as a memoryview, or None (no sync)/'' (no full frame yet) in non-blocking mode
+		"""
+		one_frame_buffer = self._extract_frame()	# Frames may already be waiting in our buffer from a previous read
+		while one_frame_buffer is None:
+			self._feed(self._phy_decoder.get_next_incoming_bytes(terminator=self.ETX_BYTE))
+			one_frame_buffer = self._extract_frame()
+			if one_frame_buffer is None and not self._phy_decoder.blocking:
+				return '' if self.initial_frame_sync else None
+		return one_frame_buffer
+
+	def iter_frames(self):
+		"""@brief Iterate over all the frames that are available after (at most) one read from the PhyDecoder
+
+		If a single read brings several frames, they are all returned without any further read.
+
+		@return A generator of frame payloads (without STX and ETX bytes) as memoryviews
+		"""
+		for (buf, start, end) in self.iter_frame_spans():
+			yield memoryview(buf)[start:end]
+
+	def iter_frame_spans(self):
+		"""@brief Like iter_frames(), but return the location of each frame in our internal buffer (eg: to decode it with TICFrames.decode_frame() without any copy)
+
+		@return A generator of tuples (buffer, start, end), where buffer is a bytearray containing the frame payload (without STX and ETX bytes) between offsets start and end
+		"""
+		span = self._extract_frame_span()
+		if span is None:
+			self._feed(self._phy_decoder.get_next_incoming_bytes(terminator=self.ETX_BYTE))
+			span = self._extract_frame_span()
+		while span is not None:
+			yield (self.incoming_buffer, span[0], span[1])
+			span = self._extract_frame_span()
 
 class TICDataSetExtractor:
 	"""@brief Extractor of TIC datasets based on a link-layer TIC frame
+
+	The frame is tokenized in a single pass, by moving an offset along the frame instead of re-slicing it.
+	The frame may be a string, or a bytearray in which only the bytes between two offsets are decoded (so that frames are decoded in place in the TICLinkLayerDecoder buffer).
 	"""
-	LF = '\x0A'
-	CR = '\x0D'
+	LF = b'\x0A'
+	CR = b'\x0D'
+	STANDARD_SEPARATOR = b'\x09'
+	HISTORIQUE_SEPARATOR = b'\x20'
 
-	def __init__(self, frame):
+	def __init__(self, frame, separator=STANDARD_SEPARATOR, start=0, end=None):
 		"""@brief Create a TIC dataset extractor based on a raw TIC frame payload
 
-		@param frame The raw TIC frame (without STX/ETX bytes)
+		@param frame The raw TIC frame (without STX/ETX bytes), as a string or a bytearray
+		@param separator The byte separating fields inside a dataset (STANDARD_SEPARATOR for "TIC standard", HISTORIQUE_SEPARATOR for "TIC historique")
+		@param start The offset of the frame payload in frame
+		@param end The offset of the end of the frame payload in frame, or None for the end of frame
 		"""
 		self.frame = frame
+		self.separator = separator
+		self._pos = start	# Position of the next dataset to extract in the frame
+		self._end = len(frame) if end is None else end
 
 	def __iter__(self):
-		while len(self.frame) > 0:
+		while self._pos < self._end:
 			dataset = self.get_next_dataset()
 			if dataset is None:
 				return
 			else:
 				yield dataset
 
+	def _next_dataset_bounds(self):
+		"""@brief Locate the next dataset in the frame, and move past it
+
+		@return A tuple (start, end) containing the offsets of the dataset content (without LF and CR markers), or None if the frame was fully decoded
+		"""
+		start_dataset_pos = self.frame.find(self.LF, self._pos, self._end)
+		if start_dataset_pos == -1:	# No start marker, do not decode
+			self._pos = self._end
+			return None
+		if start_dataset_pos != self._pos:
+			log.emit('WARNING', 'dataset_leading_garbage')
+		start_dataset_pos += 1	# Skip dataset starting marker
+		end_dataset_pos = self.frame.find(self.CR, start_dataset_pos, self._end)
+		if end_dataset_pos == -1:	# No end marker, assume the dataset spans the whole remaining frame
+			end_dataset_pos = self._end
+		self._pos = end_dataset_pos + 1	# Skip the dataset end marker, a next extraction will start from the trailing bytes
+		return (start_dataset_pos, end_dataset_pos)
+
 	def get_next_dataset(self):
 		"""@brief Continue parsing the next available dataset
 
 		@return The new dataset as a buffer (or  None if the frame was fully decoded)
 		"""
-		start_dataset_pos = self.frame.find(self.LF)
-		if start_dataset_pos == -1:	# No start marker, do not decode
+		bounds = self._next_dataset_bounds()
+		if bounds is None:
 			return None
-		if start_dataset_pos != 0:
-			print('Warning leading garbage in dataset')
-		self.frame = self.frame[start_dataset_pos+1:]	# Remove dataset starting marker
-		end_dataset_pos = self.frame.find(self.CR)
-		if end_dataset_pos == -1:	# No end marker, assume we have to return the whole frame
-			dataset = self.frame
-			self.frame = ''
-			return dataset
-		else:
-			dataset = self.frame[:end_dataset_pos]
-			self.frame = self.frame[end_dataset_pos+1:]	# Remove the dataset end marker, and keep the trailing bytes for a next extraction
-			return dataset
+		return self.frame[bounds[0]:bounds[1]]
+
+	def iter_spans(self):
+		"""@brief Tokenize the remaining datasets, without creating any intermediate string
+
+		Each dataset is made of: label, separator, [horodate, separator,] value, separator, checksum
+
+		@return A generator of tuples (label, horodate, value, checksum) for each dataset.
+		label, horodate and value are (start, end) offsets inside the frame (horodate is None if the dataset has no horodate).
+		checksum is the offset of the checksum byte.
+		For a malformed dataset, value is None and label contains the offsets of the whole dataset.
+		"""
+		frame = self.frame
+		separator = self.separator
+		while self._pos < self._end:
+			bounds = self._next_dataset_bounds()
+			if bounds is None:
+				return
+			(start, end) = bounds
+			checksum = end - 1	# The checksum is always the last byte (and may be equal to the separator in "TIC historique")
+			label_end = frame.find(separator, start, checksum)
+			value_end = frame.rfind(separator, start, checksum)
+			if label_end == -1 or value_end != checksum - 1 or value_end == label_end:	# Missing fields or checksum longer than one byte
+				yield ((start, end), None, None, checksum)
+				continue
+			horodate_end = frame.find(separator, label_end + 1, value_end)
+			if horodate_end == -1:
+				yield ((start, label_end), None, (label_end + 1, value_end), checksum)
+			elif frame.find(separator, horodate_end + 1, value_end) == -1:	# standardMode has some fields with date before the value.
+				yield ((start, label_end), (label_end + 1, horodate_end), (horodate_end + 1, value_end), checksum)
+			else:
+				yield ((start, end), None, None, checksum)
+
+class TICFrame(object):
+	"""@brief A decoded TIC frame, storing one typed value per label
+
+	Records of the same TICFrames instance share a single label index, so each record only holds a list of values.
+	It can be read like a dict, but labels missing from the frame (or with an invalid value) are not present.
+	"""
+	__slots__ = ('_index', '_values', 'counters')
+
+	def __init__(self, index, values, counters=None):
+		"""@brief Constructor
+
+		@param index A dict providing the position of each label in values
+		@param values The list of values (None for missing labels)
+		@param counters The increments of the TICFrames dataset counters caused by decoding this frame, ordered like TICFrames.get_counters() (None if unknown)
+		"""
+		self._index = index
+		self._values = values
+		self.counters = counters
+
+	def get(self, label, default=None):
+		pos = self._index.get(label)
+		if pos is None or pos >= len(self._values):
+			return default
+		value = self._values[pos]
+		if value is None:
+			return default
+		return value
+
+	def __getitem__(self, label):
+		value = self.get(label)
+		if value is None:
+			raise KeyError(label)
+		return value
+
+	def __contains__(self, label):
+		return self.get(label) is not None
+
+	def items(self):
+		"""@return A list of (label, value) tuples for all labels present in the frame
+		"""
+		return [(label, self._values[pos]) for (label, pos) in self._index.items() if pos < len(self._values) and self._values[pos] is not None]
+
+	def __repr__(self):
+		return 'TICFrame(' + str(dict(self.items())) + ')'
 
 class TICFrames:
 	"""@brief Class that allows to extract data from TIC frames
 	"""
-	def __init__(self, tic_link_frame_fetcher, standard_tic_mode=False):
+	def __init__(self, tic_link_frame_fetcher, standard_tic_mode=False, labels=None):
 		"""@brief Create a TIC frame parsing instance
 
 		@param tic_link_frame_fetcher An object of type TICLinkLayerDecoder used to fetch and extract TIC datasets
 		@param standard_tic_mode True if we should we decode using "TIC standard" mode, False if we should decode using "TIC historique" mode
+		@param labels An optional list of the only labels we are interested in. Datasets with other labels are skipped without checksum verification nor value parsing. It can also be a dict providing the list of labels for each TIC mode (True for "TIC standard"), so that decoding a frame stops as soon as all labels of the current mode were found
 		"""
 		self._tic_link_frame_fetcher = tic_link_frame_fetcher
-		self.standard_tic_mode = standard_tic_mode
+		if isinstance(labels, dict):
+			self._labels_by_mode = dict((mode, None if mode_labels is None else list(mode_labels)) for (mode, mode_labels) in labels.items())
+		else:
+			self._labels_by_mode = {True: labels, False: labels}
+		self.set_mode(standard_tic_mode)
+		self.nb_datasets_decoded = 0	# Number of datasets for which the checksum and value have been parsed
+		self.nb_datasets_skipped = 0	# Number of datasets ignored because their label is not in self.labels
+		self.nb_invalid_values = 0	# Number of datasets with a valid checksum, but a value that does not match the label type
+		self.nb_checksum_errors = 0	# Number of datasets dropped because of a checksum mismatch
+		self.nb_malformed_datasets = 0	# Number of datasets dropped because they do not contain the expected fields
 
 	def __iter__(self):
 		while True:
 			yield self.get_next()
 
+	def set_mode(self, standard_tic_mode):
+		"""@brief Change the TIC mode used to decode the next frames (eg: after an automatic detection)
+
+		@param standard_tic_mode True if we should we decode using "TIC standard" mode, False if we should decode using "TIC historique" mode
+		"""
+		self.standard_tic_mode = standard_tic_mode
+		requested_labels = self._labels_by_mode.get(standard_tic_mode)
+		if requested_labels is None:
+			self.labels = None
+			record_labels = sorted(TICSchema.get_label_types(standard_tic_mode).keys())
+		else:
+			self.labels = frozenset(requested_labels)
+			record_labels = list(requested_labels)
+		# Resolve the value converter of each label once and for all
+		self._converters = TICSchema.get_converters(standard_tic_mode=standard_tic_mode, labels=record_labels)
+		self._record_index = dict((label, pos) for (pos, label) in enumerate(record_labels))	# A new dict, records already returned keep the previous one
+
+	def get_counters(self):
+		"""@brief Get the dataset counters, as a tuple (nb_datasets_decoded, nb_datasets_skipped, nb_invalid_values, nb_checksum_errors, nb_malformed_datasets)
+		"""
+		return (self.nb_datasets_decoded, self.nb_datasets_skipped, self.nb_invalid_values, self.nb_checksum_errors, self.nb_malformed_datasets)
+
+	def add_counters(self, counters):
+		"""@brief Add increments to the dataset counters (eg: for frames decoded by another TICFrames instance)
+
+		@param counters A tuple ordered like the result of get_counters()
+		"""
+		(self.nb_datasets_decoded, self.nb_datasets_skipped, self.nb_invalid_values, self.nb_checksum_errors, self.nb_malformed_datasets) = \
+			tuple(total + increment for (total, increment) in zip(self.get_counters(), counters))
+
 	@staticmethod
-	def _checksum(data):
-		chksum = sum([ord(c) for c in data])
-		chksum = (chksum & 63) + 32
-		return chr(chksum)
+	def compute_checksum(data):
+		"""@brief Compute the checksum of a dataset
+
+		@param data The checksummed part of the dataset, as a bytearray or a string
+		@return The expected checksum byte value (as an int)
+		"""
+		if not isinstance(data, bytearray):
+			data = bytearray(data)
+		return (sum(data) & 63) + 32
 
 	def get_next(self):
 		frame = ''
 		while not frame:	# Block until a new frame is available
 			frame = self._tic_link_frame_fetcher()
-			if not frame:
+			if not frame:	# Only happens with a non-blocking PhyDecoder, retry later
 				time.sleep(0.2)
+		return self.decode_frame(frame)
 
-		dataset_extractor = TICDataSetExtractor(frame=frame)
-		decoded_frame = {}
-		for dataset in dataset_extractor:
-			if self.standard_tic_mode:
-				data_payload = dataset.split("\t")
-				checksummed_payload = dataset[:-1]
+	def decode_frame(self, frame, start=0, end=None):
+		"""@brief Decode all datasets of one link-layer TIC frame
+
+		A frame given as a bytearray is decoded in place, only the labels and values we keep are copied.
+
+		@param frame The raw TIC frame (without STX/ETX bytes), as a string, a memoryview, or a bytearray (eg: a span returned by TICLinkLayerDecoder.iter_frame_spans())
+		@param start The offset of the frame payload in frame
+		@param end The offset of the end of the frame payload in frame, or None for the end of frame
+		@return A TICFrame containing the typed value of each dataset (only the labels we are interested in, if a label list was provided)
+		"""
+		if isinstance(frame, memoryview):
+			frame = bytearray(frame)	# A memoryview cannot be searched, this is the only copy of the frame
+		if end is None:
+			end = len(frame)
+		if isinstance(frame, bytearray):
+			frame_bytes = frame
+		else:
+			frame_bytes = bytearray(frame)	# Byte values of the frame, so that checksums are summed directly by sum() without per-character conversion
+		if self.standard_tic_mode:
+			dataset_extractor = TICDataSetExtractor(frame=frame, separator=TICDataSetExtractor.STANDARD_SEPARATOR, start=start, end=end)
+			checksum_excluded_bytes = 0	# The separator before the checksum is included in the checksum
+		else:
+			dataset_extractor = TICDataSetExtractor(frame=frame, separator=TICDataSetExtractor.HISTORIQUE_SEPARATOR, start=start, end=end)
+			checksum_excluded_bytes = 1	# The separator before the checksum is not included in the checksum
+		wanted_labels = self.labels
+		converters = self._converters
+		record_index = self._record_index
+		values = [None] * len(record_index)
+		nb_values_found = 0
+		nb_datasets_decoded = 0
+		nb_datasets_malformed = 0
+		nb_checksum_errors = 0
+		nb_invalid_values = 0
+		for (label, horodate, value, checksum) in dataset_extractor.iter_spans():
+			if value is None:
+				nb_datasets_malformed += 1
+				continue
+
+			etiquette = bytes(frame[label[0]:label[1]])	# A string, even when decoding a bytearray
+			if wanted_labels is not None and etiquette not in wanted_labels:
+				continue
+			nb_datasets_decoded += 1
+			if frame_bytes[checksum] != (sum(frame_bytes[label[0]:checksum-checksum_excluded_bytes]) & 63) + 32:	# Inlined compute_checksum()
+				nb_checksum_errors += 1
+				continue
+			converter = converters.get(etiquette)
+			if converter is None:	# Label unknown to our schema, keep it as a string
+				converter = TICSchema.to_string
+				converters[etiquette] = converter
+				record_index[etiquette] = len(record_index)
+				values.append(None)
+			if converter is TICSchema.to_horodate:	# Horodate-only label, the value field is empty
+				typed_value = None
+				if horodate is not None:
+					typed_value = converter(bytes(frame[horodate[0]:horodate[1]]).strip())
 			else:
-				data_payload = dataset.split(" ")
-				checksummed_payload = dataset[:-2]
-
-			etiquette = data_payload[0]
-			if len(data_payload) == 3:
-				value = data_payload[1].strip()
-			elif len(data_payload) == 4: #standardMode has some fields with date before the value.
-				value = (data_payload[1].strip(),data_payload[2].strip())
+				typed_value = converter(bytes(frame[value[0]:value[1]]).strip())
+				if horodate is not None and typed_value is not None:	# Value with a horodate, we return a tuple (horodate, value)
+					typed_horodate = TICSchema.to_horodate(bytes(frame[horodate[0]:horodate[1]]).strip())
+					if typed_horodate is None:
+						typed_value = None
+					else:
+						typed_value = (typed_horodate, typed_value)
+			if typed_value is None:
+				nb_invalid_values += 1
+				continue
+			values[record_index[etiquette]] = typed_value
+			nb_values_found += 1
+			if wanted_labels is not None and nb_values_found == len(wanted_labels):
+				break	# We already have all the labels we are interested in, skip the rest of the frame
+
+		nb_datasets_skipped = 0
+		if wanted_labels is not None:
+			nb_datasets_skipped = frame.count(TICDataSetExtractor.LF, start, end) - nb_datasets_decoded - nb_datasets_malformed
+		counters = (nb_datasets_decoded, nb_datasets_skipped, nb_invalid_values, nb_checksum_errors, nb_datasets_malformed)
+		self.add_counters(counters)
+		return TICFrame(record_index, values, counters)
+
+class TICFrameEncoder:
+	"""@brief Class that allows to build TIC frames (eg: to simulate a meter)
+	"""
+	def __init__(self, standard_tic_mode=False):
+		"""@brief Create a TIC frame encoder
+
+		@param standard_tic_mode True if we should we encode using "TIC standard" mode, False if we should encode using "TIC historique" mode
+		"""
+		self.standard_tic_mode = standard_tic_mode
+
+	def encode_dataset(self, label, value, horodate=None):
+		"""@brief Encode one dataset, including its LF and CR markers and its checksum
+
+		@param label The dataset label
+		@param value The dataset value, as a string
+		@param horodate An optional horodate string ("TIC standard" only)
+		@return The encoded dataset
+		"""
+		if self.standard_tic_mode:
+			separator = TICDataSetExtractor.STANDARD_SEPARATOR
+			payload = label + separator
+			if horodate is not None:
+				payload += horodate + separator
+			payload += value + separator	# The separator before the checksum is included in the checksum
+			checksum = TICFrames.compute_checksum(payload)
+		else:
+			assert horodate is None
+			separator = TICDataSetExtractor.HISTORIQUE_SEPARATOR
+			payload = label + separator + value
+			checksum = TICFrames.compute_checksum(payload)
+			payload += separator	# The separator before the checksum is not included in the checksum
+		return TICDataSetExtractor.LF + payload + chr(checksum) + TICDataSetExtractor.CR
+
+	def encode_frame(self, datasets):
+		"""@brief Encode a full frame, including STX and ETX markers
+
+		@param datasets A list of tuples (label, value) or (label, horodate, value)
+		@return The encoded frame
+		"""
+		encoded_datasets = []
+		for dataset in datasets:
+			if len(dataset) == 2:
+				encoded_datasets.append(self.encode_dataset(label=dataset[0], value=dataset[1]))
 			else:
-				print('Error: Bad data payload:' + str(dataset))
+				encoded_datasets.append(self.encode_dataset(label=dataset[0], horodate=dataset[1], value=dataset[2]))
+		return TICLinkLayerDecoder.STX_BYTE + b''.join(encoded_datasets) + TICLinkLayerDecoder.ETX_BYTE
+
+class TICChangeEncoder:
+	"""@brief Turn successive TICFrame records into a stream of change events
+
+	Most labels (meter ID, contract, indexes...) keep the same value from one frame to the next, so only the labels whose value changed are emitted.
+	A full snapshot is emitted periodically (and after any discontinuity), so that a receiver can resynchronize.
+
+	Each event is a tuple (seq, timestamp, snapshot, changes) where changes is a tuple of (label, value) pairs.
+	In a snapshot, changes contains all labels present in the frame, otherwise a None value means the label disappeared from the frame.
+	seq is incremented for each event, so that a receiver can detect lost events (and wait for the next snapshot).
+	"""
+	def __init__(self, snapshot_interval=300):
+		"""@brief Constructor
+
+		@param snapshot_interval The maximum time (in seconds) between two full snapshots
+		"""
+		self.snapshot_interval = snapshot_interval
+		self._index = None	# Label index of the last encoded record
+		self._labels = []	# The label at each position of self._index
+		self._values = None	# Values of the last encoded record
+		self._last_snapshot_time = None
+		self.seq = 0	# Sequence number of the last event
+		self.nb_frames = 0
+		self.nb_snapshots = 0
+		self.nb_values_emitted = 0
+
+	def force_snapshot(self):
+		"""@brief Emit a full snapshot for the next frame (eg: because the previous event was lost)
+		"""
+		self._last_snapshot_time = None
+
+	def encode(self, frame, timestamp=None):
+		"""@brief Compute the change event of a new frame
+
+		@param frame The new TICFrame
+		@param timestamp The reception time of the frame (now by default)
+		@return The change event
+		"""
+		if timestamp is None:
+			timestamp = time.time()
+		values = frame._values
+		if frame._index is not self._index:	# The TIC mode changed, positions of the previous values do not match anymore
+			self._index = frame._index
+			self._last_snapshot_time = None
+		if len(self._labels) != len(self._index):	# New labels were added to the index (eg: unknown labels kept as strings)
+			self._labels = sorted(self._index, key=self._index.get)
+		labels = self._labels
+		if self._last_snapshot_time is None or not 0 <= timestamp - self._last_snapshot_time < self.snapshot_interval:
+			snapshot = True
+			changes = tuple((labels[pos], value) for (pos, value) in enumerate(values) if value is not None)
+			self._last_snapshot_time = timestamp
+			self.nb_snapshots += 1
+		else:
+			snapshot = False
+			previous_values = self._values
+			nb_previous_values = len(previous_values)
+			changes = tuple((labels[pos], value) for (pos, value) in enumerate(values) if value != (previous_values[pos] if pos < nb_previous_values else None))
+			if nb_previous_values > len(values):	# Values of labels added since this frame was decoded
+				changes += tuple((labels[pos], None) for pos in range(len(values), nb_previous_values) if previous_values[pos] is not None)
+		self._values = values	# Records are never modified once decoded, so no copy is needed
+		self.seq += 1
+		self.nb_frames += 1
+		self.nb_values_emitted += len(changes)
+		return (self.seq, timestamp, snapshot, changes)
+
+class TICChangeDecoder:
+	"""@brief Rebuild full TICFrame records from the change events of a TICChangeEncoder
+	"""
+	def __init__(self):
+		self._index = {}	# Position of each label in self._values, only growing so that records already returned stay valid
+		self._values = None	# Current value of each label, None until the first snapshot (and after a lost event)
+		self._seq = None	# Sequence number of the last applied event
+		self.nb_events_ignored = 0	# Number of events received while waiting for a snapshot
+		self.nb_gaps = 0	# Number of times events were lost
+
+	def apply(self, event):
+		"""@brief Update the current state with a change event
+
+		@param event A change event, as returned by TICChangeEncoder.encode()
+		@return A TICFrame with the current value of each label, or None if we are waiting for a snapshot (none received yet, or some events were lost since the last one)
+		"""
+		(seq, _, snapshot, changes) = event
+		if snapshot:
+			self._values = [None] * len(self._index)
+		elif self._values is not None and seq != self._seq + 1:	# Lost events, the changes they carried are missing from our state
+			self._values = None
+			self.nb_gaps += 1
+		self._seq = seq
+		if self._values is None:
+			self.nb_events_ignored += 1
+			return None
+		index = self._index
+		values = self._values
+		for (label, value) in changes:
+			pos = index.get(label)
+			if pos is None:
+				pos = len(index)
+				index[label] = pos
+				values.append(None)
+			values[pos] = value
+		return TICFrame(index, list(values))
+
+class TICModeDetector:
+	"""@brief Automatic detection of the baudrate and TIC mode ("TIC standard" or "TIC historique") of a meter
+
+	Each baudrate is tried in turn, and the frames received are decoded using both the "TIC standard" and "TIC historique" separator and checksum rules.
+	We lock on the first baudrate and mode that validate a few successive frames.
+	Once locked, the error rate of decoded frames is monitored, and detection runs again if errors persist or if no valid frame is received for too long.
+	Detection never blocks a TICPipeline: frames are fed by the pipeline's frame interceptor, and baudrates are switched by a timer.
+	"""
+	BAUDRATES = (9600, 1200)	# "TIC standard" is normally sent at 9600 bauds, and "TIC historique" at 1200 bauds
+	MAX_FRAME_SIZE = {9600: 1000, 1200: 300}	# Size of the longest frame expected at each baudrate, in bytes ("TIC standard" at 9600 bauds, "TIC historique" at 1200 bauds)
+	BITS_PER_BYTE = 10	# 7E1 serial format: 1 start bit, 7 data bits, 1 parity bit, 1 stop bit
+
+	def __init__(self, link_decoder, tic_frames, baudrates=BAUDRATES, lock_frames=2, error_window=20, max_error_rate=0.5, max_silence=10):
+		"""@brief Constructor
+
+		@param link_decoder The TICLinkLayerDecoder reading from the meter (its PhyDecoder's baudrate is changed during detection)
+		@param tic_frames The TICFrames instance whose mode is set once the mode is detected
+		@param baudrates The baudrates to try, in order
+		@param lock_frames The number of successive valid frames required to lock on a baudrate and mode
+		@param error_window The number of recent frames over which the error rate is computed once locked
+		@param max_error_rate The proportion of invalid frames in the window above which detection runs again
+		@param max_silence The time (in seconds) without any valid frame after which detection runs again
+		"""
+		self._link_decoder = link_decoder
+		self._phy_decoder = link_decoder._phy_decoder
+		self._tic_frames = tic_frames
+		self.baudrates = baudrates
+		self.lock_frames = lock_frames
+		self.max_error_rate = max_error_rate
+		self.max_silence = max_silence
+		self._probes = {True: TICFrames(tic_link_frame_fetcher=None, standard_tic_mode=True),
+		                False: TICFrames(tic_link_frame_fetcher=None, standard_tic_mode=False)}	# Used to validate frames in each mode
+		self._recent_errors = collections.deque(maxlen=error_window)	# For each recent frame, True if it was invalid
+		self._last_valid_frame_time = time.time()
+		self.locked = False
+		self.detecting = False	# True while a detection is running
+		self.result = None	# The tuple (baudrate, standard_tic_mode) found by the last detection
+		self.nb_detections = 0
+
+	@staticmethod
+	def _is_frame_valid(counters):
+		"""@brief Check the dataset counters increments of one decoded frame
+
+		@param counters The counters of the decoded TICFrame
+		@return True if datasets were decoded, and at most 10% of them were invalid
+		"""
+		(nb_decoded, nb_skipped, nb_invalid, nb_checksum_errors, nb_malformed) = counters
+		nb_datasets = nb_decoded + nb_malformed
+		return nb_datasets > 0 and (nb_checksum_errors + nb_malformed) * 10 <= nb_datasets
+
+	def _get_frame_mode(self, frame):
+		"""@return The TIC mode (True for "TIC standard") in which a frame is valid, or None if it is valid in no mode
+		"""
+		for (standard_tic_mode, probe) in self._probes.items():
+			if self._is_frame_valid(probe.decode_frame(frame).counters):
+				return standard_tic_mode
+		return None
+
+	def start(self, max_attempts=None):
+		"""@brief Start a detection, without waiting for its result
+
+		The detection then progresses with each call to intercept_frame() and step() (eg: from a TICPipeline, see detect() for a blocking detection).
+
+		@param max_attempts The maximum number of times all baudrates are tried, or None to try forever
+		"""
+		self.locked = False
+		self.detecting = True
+		self.result = None
+		self.nb_detections += 1
+		self._max_attempts = max_attempts
+		self._attempt = 1
+		self._listen(0)
+
+	def _listen(self, baudrate_pos):
+		"""@brief Start listening at one of the baudrates to try
+
+		@param baudrate_pos The position of the baudrate in self.baudrates
+		"""
+		baudrate = self.baudrates[baudrate_pos]
+		if self._phy_decoder.baudrate != baudrate:
+			self._phy_decoder.set_baudrate(baudrate)
+		self._link_decoder.reset()
+		self._baudrate_pos = baudrate_pos
+		self._candidate = None	# The TIC mode of the last valid frames
+		self._nb_valid_frames = 0	# The number of successive valid frames in the candidate mode
+		self._listen_end = time.time() + self.get_listen_duration(baudrate)
+
+	def get_listen_duration(self, baudrate):
+		"""@brief Get the time to wait for frames at a baudrate before trying the next one
+
+		Locking requires lock_frames full frames, and listening may start in the middle of a frame, so we wait for lock_frames + 1 of the longest frames.
+
+		@param baudrate The baudrate
+		@return The duration in seconds
+		"""
+		max_frame_size = self.MAX_FRAME_SIZE.get(baudrate, max(self.MAX_FRAME_SIZE.values()))
+		return float(max_frame_size * self.BITS_PER_BYTE) / baudrate * (self.lock_frames + 1)
+
+	def step(self):
+		"""@brief Try the next baudrate if no mode was found at the current one within its listening duration
+
+		@return The delay before step() must be called again, or None if no detection is running
+		"""
+		if not self.detecting:
+			return None
+		remaining = self._listen_end - time.time()
+		if remaining > 0:
+			return remaining
+		if self._baudrate_pos + 1 < len(self.baudrates):
+			self._listen(self._baudrate_pos + 1)
+		else:
+			log.emit('ERROR', 'tic_mode_detection_failed', attempt=self._attempt)
+			if self._max_attempts is not None and self._attempt >= self._max_attempts:
+				self.detecting = False
+				return None
+			self._attempt += 1
+			self._listen(0)
+		return self._listen_end - time.time()
+
+	def intercept_frame(self, frame):
+		"""@brief Use a link-layer frame for the running detection, if any (to be registered as the TICPipeline frame interceptor)
+
+		@param frame The raw TIC frame (without STX/ETX bytes)
+		@return True if the frame must be decoded as usual, False if it was used for the detection
+		"""
+		if not self.detecting:
+			return True
+		standard_tic_mode = self._get_frame_mode(frame)
+		if standard_tic_mode is not None and standard_tic_mode == self._candidate:
+			self._nb_valid_frames += 1
+		else:
+			self._candidate = standard_tic_mode
+			self._nb_valid_frames = 0 if standard_tic_mode is None else 1
+		if self._nb_valid_frames >= self.lock_frames:
+			baudrate = self._phy_decoder.baudrate
+			self._tic_frames.set_mode(standard_tic_mode)
+			self._recent_errors.clear()
+			self._last_valid_frame_time = time.time()
+			self.locked = True
+			self.detecting = False
+			self.result = (baudrate, standard_tic_mode)
+			log.emit('INFO', 'tic_mode_detected', min_interval=0, baudrate=baudrate, mode=('standard' if standard_tic_mode else 'historique'))
+		return False
+
+	def detect(self, max_attempts=None):
+		"""@brief Find the baudrate and TIC mode of the meter, and configure the PhyDecoder and TICFrames accordingly
+
+		This blocks until the detection ends, use start() instead when frames are read by a TICPipeline.
+
+		@param max_attempts The maximum number of times all baudrates are tried, or None to try forever
+		@return A tuple (baudrate, standard_tic_mode), or None if detection failed
+		"""
+		self.start(max_attempts=max_attempts)
+		fileno = self._phy_decoder.fileno()
+		while self.detecting:
+			delay = self.step()
+			if not self.detecting:
+				break
+			if fileno is None:	# Replayed capture, bytes are always ready
+				if self._phy_decoder.eof:
+					self._listen_end = 0	# Nothing more to listen to at this baudrate
+					continue
+			elif not select.select([fileno], [], [], delay)[0]:
 				continue
+			for frame in self._link_decoder.iter_frames():
+				self.intercept_frame(frame)
+				if not self.detecting:
+					break
+		return self.result
+
+	def frame_decoded(self, item):
+		"""@brief Monitor a frame decoded by the TICFrames instance (to be registered as a TICPipeline consumer)
+
+		@param item A tuple (reception time, TICFrame)
+		"""
+		if self.detecting:	# Frame queued before the detection started
+			return
+		valid = self._is_frame_valid(item[1].counters)	# Counters of this frame only, other frames may have been decoded since
+		self._recent_errors.append(not valid)
+		if valid:
+			self._last_valid_frame_time = time.time()
+		elif len(self._recent_errors) == self._recent_errors.maxlen and sum(self._recent_errors) > self.max_error_rate * len(self._recent_errors):
+			log.emit('WARNING', 'tic_error_rate_too_high', min_interval=0, nb_invalid_frames=sum(self._recent_errors))
+			self.start()
+
+	def check_silence(self):
+		"""@brief Step the running detection, or start a new one if no valid frame was received for too long (to be registered as a TICPipeline timer)
 
-			enclosed_checksum = dataset[-1]
-			computed_checksum = self._checksum(checksummed_payload)
-			if enclosed_checksum == computed_checksum:
-				decoded_frame[etiquette] = value
+		@return The delay before the next check
+		"""
+		if not self.detecting:
+			silence = time.time() - self._last_valid_frame_time
+			if silence < self.max_silence:
+				return self.max_silence - silence
+			log.emit('WARNING', 'tic_silence', min_interval=0, duration=int(silence))
+			self.start()
+		delay = self.step()
+		if delay is None:	# The detection ended with a failure
+			return self.max_silence
+		return delay
+
+class ConsumerQueue:
+	"""@brief Bounded queue of items waiting to be processed by one consumer of a TICPipeline
+
+	When the queue is full, the oldest item is dropped: a slow consumer never holds up decoding, it only misses intermediate items.
+	"""
+	def __init__(self, name, callback=None, maxlen=1):
+		"""@brief Create a consumer queue
+
+		@param name The consumer name (for statistics)
+		@param callback A function called by the pipeline with each item, or None if items are pulled using TICPipeline.iter_items()
+		@param maxlen The maximum number of items waiting in the queue
+		"""
+		self.name = name
+		self.callback = callback
+		self._items = collections.deque(maxlen=maxlen)
+		self.nb_items_put = 0
+		self.nb_items_dropped = 0	# Number of items discarded because the consumer was late
+
+	def __len__(self):
+		return len(self._items)
+
+	def put(self, item):
+		"""@brief Queue a new item, dropping the oldest one if the queue is full
+		"""
+		if len(self._items) == self._items.maxlen:
+			self.nb_items_dropped += 1
+		self._items.append(item)	# The deque discards its oldest item by itself
+		self.nb_items_put += 1
+
+	def pop(self):
+		"""@brief Get the oldest item waiting in the queue
+
+		@return The item, or None if the queue is empty
+		"""
+		if not self._items:
+			return None
+		return self._items.popleft()
+
+class TICPipeline:
+	"""@brief Single-threaded decoding pipeline, dispatching decoded frames to several consumers
+
+	Incoming bytes are waited for using poll(), and decoding always takes precedence: between two reads, each consumer with pending items is handed one item, then more items only while no new byte is waiting on the serial port.
+	Consumers (display, history persistence, exporters...) thus run cooperatively in the same thread, and a slow consumer only makes its own queue drop old items.
+	"""
+	def __init__(self, link_decoder, tic_frames, metrics=None):
+		"""@brief Create a pipeline
+
+		@param link_decoder The TICLinkLayerDecoder to read frames from (its PhyDecoder must be non-blocking, the pipeline waits for bytes itself)
+		@param tic_frames The TICFrames instance used to decode frames (its frame fetcher is not used)
+		@param metrics An optional MetricsRegistry, in which decoding times, decoding errors and consumer drops are reported
+		"""
+		self._phy_decoder = link_decoder._phy_decoder
+		assert not self._phy_decoder.blocking
+		self._link_decoder = link_decoder
+		self._tic_frames = tic_frames
+		self._fileno = self._phy_decoder.fileno()
+		self._poller = select.poll()
+		if self._fileno is not None:
+			self._poller.register(self._fileno, select.POLLIN)
+		self._readers = {}	# Callbacks of other file descriptors, indexed by file descriptor
+		self._timers = []	# Callbacks run at each loop iteration, returning the delay until they need to run again
+		self.consumers = []	# All consumer queues, in the order they are run
+		self._frame_consumers = []	# Consumer queues that receive decoded frames
+		self._change_consumers = []	# Tuples (TICChangeEncoder, queue) of the consumers that receive change events
+		self._frame_interceptor = None
+		self.nb_frames_decoded = 0
+		self._metrics = metrics
+		self._decode_histogram = None
+		if metrics is not None:
+			self._decode_histogram = metrics.add_histogram('tic_decode_seconds')
+			metrics.add_gauge('tic_frames_decoded', lambda: self.nb_frames_decoded)
+			metrics.add_gauge('tic_resyncs', lambda: link_decoder.nb_resyncs)
+			metrics.add_gauge('tic_checksum_errors', lambda: tic_frames.nb_checksum_errors)
+			metrics.add_gauge('tic_invalid_values', lambda: tic_frames.nb_invalid_values)
+			metrics.add_gauge('tic_malformed_datasets', lambda: tic_frames.nb_malformed_datasets)
+
+	def add_consumer(self, name, callback=None, maxlen=1, subscribe=True):
+		"""@brief Register a new consumer
+
+		@param name The consumer name (for statistics)
+		@param callback A function called with each item, or None if items are pulled using iter_items()
+		@param maxlen The maximum number of items waiting for this consumer, older items are dropped
+		@param subscribe If True, each decoded frame is queued as a tuple (reception time, TICFrame). Otherwise, items are only queued explicitly using the returned queue's put() (eg: by another consumer)
+		@return The ConsumerQueue of this consumer
+		"""
+		queue = ConsumerQueue(name=name, callback=callback, maxlen=maxlen)
+		self.consumers.append(queue)
+		if subscribe:
+			self._frame_consumers.append(queue)
+		if self._metrics is not None:
+			self._metrics.add_gauge('consumer_' + name + '_dropped', lambda: queue.nb_items_dropped)
+		return queue
+
+	def add_change_consumer(self, name, callback=None, maxlen=1, snapshot_interval=300):
+		"""@brief Register a new consumer that only receives the labels that changed since the previous frame
+
+		Items are change events (see TICChangeEncoder). If an event is dropped because the consumer was late, the next event is a full snapshot (TICChangeDecoder detects the gap from sequence numbers, and ignores the events already queued until then).
+
+		@param name The consumer name (for statistics)
+		@param callback A function called with each event, or None if events are pulled using iter_items()
+		@param maxlen The maximum number of events waiting for this consumer, older events are dropped
+		@param snapshot_interval The maximum time (in seconds) between two full snapshots
+		@return The ConsumerQueue of this consumer
+		"""
+		queue = self.add_consumer(name=name, callback=callback, maxlen=maxlen, subscribe=False)
+		self._change_consumers.append((TICChangeEncoder(snapshot_interval=snapshot_interval), queue))
+		return queue
+
+	def set_frame_interceptor(self, callback):
+		"""@brief Hand link-layer frames to a function before they are decoded (eg: TICModeDetector.intercept_frame() to detect the TIC mode)
+
+		@param callback A function called with each raw TIC frame (as a memoryview), returning False if the frame must not be decoded, or None to remove the interceptor
+		"""
+		self._frame_interceptor = callback
+
+	def add_reader(self, fileno, callback):
+		"""@brief Also wait for another file descriptor (eg: a server socket), handled in the pipeline thread
+
+		@param fileno The file descriptor to wait for
+		@param callback A function called without argument when the file descriptor is readable
+		"""
+		self._readers[fileno] = callback
+		self._poller.register(fileno, select.POLLIN)
+
+	def add_timer(self, callback):
+		"""@brief Run a periodic task in the pipeline thread
+
+		@param callback A function called without argument at each loop iteration, returning the maximum delay (in seconds) before it must be called again, or None if it only needs to run when something else happens
+		"""
+		self._timers.append(callback)
+
+	def _run_timers(self):
+		"""@brief Run the timer callbacks
+
+		@return The delay before the next timer callback must run, or None
+		"""
+		next_delay = None
+		for callback in self._timers:
+			delay = callback()
+			if delay is not None and (next_delay is None or delay < next_delay):
+				next_delay = max(delay, 0)
+		return next_delay
+
+	def _poll(self, timeout):
+		"""@brief Wait until bytes are available from the PhyDecoder, or another file descriptor is readable
+
+		@param timeout The maximum time to wait (in seconds), or None to wait forever
+		@return The list of readable file descriptors (None standing for a replayed capture)
+		"""
+		replay_pending = (self._fileno is None and not self._phy_decoder.eof)
+		if replay_pending:	# Bytes are always ready in a replayed capture
+			timeout = 0
+		if timeout is None:
+			events = self._poller.poll()
+		else:
+			events = self._poller.poll(timeout * 1000)
+		ready = [fileno for (fileno, _) in events]
+		if replay_pending:
+			ready.append(None)
+		return ready
+
+	def _handle_ready(self, ready):
+		"""@brief Process readable file descriptors returned by _poll()
+		"""
+		for fileno in ready:
+			if fileno == self._fileno:
+				self._decode_available_frames()
 			else:
-				print('Error: Bad checksum on dataset:' + str(dataset) + '| checksum:' + str(enclosed_checksum) + ', vs:' + str(computed_checksum))
+				self._readers[fileno]()
 
-		return decoded_frame
+	def _decode_available_frames(self):
+		"""@brief Read the incoming bytes, and publish all the frames they complete to the subscribed consumers
+		"""
+		timestamp = time.time()
+		decode_histogram = self._decode_histogram
+		for (buf, start, end) in self._link_decoder.iter_frame_spans():	# Frames are decoded in place in the link decoder buffer
+			if self._frame_interceptor is not None and not self._frame_interceptor(memoryview(buf)[start:end]):
+				continue
+			if decode_histogram is not None:
+				decode_start = timeit.default_timer()
+				item = (timestamp, self._tic_frames.decode_frame(buf, start, end))
+				decode_histogram.observe(timeit.default_timer() - decode_start)
+			else:
+				item = (timestamp, self._tic_frames.decode_frame(buf, start, end))
+			self.nb_frames_decoded += 1
+			for queue in self._frame_consumers:
+				queue.put(item)
+			for (change_encoder, queue) in self._change_consumers:
+				nb_items_dropped = queue.nb_items_dropped
+				queue.put(change_encoder.encode(item[1], timestamp=timestamp))
+				if queue.nb_items_dropped != nb_items_dropped:	# The consumer missed some changes
+					change_encoder.force_snapshot()
+
+	def _run_consumers_once(self):
+		"""@brief Hand one pending item to each consumer that has a callback
+
+		@return True if at least one item was processed
+		"""
+		processed = False
+		for queue in self.consumers:
+			if queue.callback is not None and len(queue):
+				queue.callback(queue.pop())
+				processed = True
+		return processed
+
+	def run_once(self, timeout=None):
+		"""@brief Process incoming bytes (if any) and run pending consumers
+
+		@param timeout The maximum time to wait for incoming bytes (in seconds), or None to wait forever. We never wait if consumers have pending items, nor after the next timer deadline
+		"""
+		timer_delay = self._run_timers()
+		if timer_delay is not None and (timeout is None or timer_delay < timeout):
+			timeout = timer_delay
+		consumers_pending = any(queue.callback is not None and len(queue) for queue in self.consumers)
+		self._handle_ready(self._poll(0 if consumers_pending else timeout))
+		processed = self._run_consumers_once()	# Consumers get at least one item per read, so that they progress even under a continuous flow of bytes
+		while processed and not self._poll(0):
+			processed = self._run_consumers_once()
+
+	def run(self):
+		"""@brief Run the pipeline forever
+		"""
+		while True:
+			self.run_once()
+
+	def iter_items(self, queue):
+		"""@brief Run the pipeline, returning the items of a consumer queue that has no callback as they become available
+
+		@param queue A ConsumerQueue returned by add_consumer(), without callback
+		@return A generator of items
+		"""
+		while True:
+			item = queue.pop()
+			while item is None:
+				self.run_once()
+				item = queue.pop()
+			yield item
+
+_worker_tic_frames = {}	# TICFrames instances of a MultiMeterReader pool worker process, indexed by (standard_tic_mode, labels)
+
+def _decode_frame_in_worker(standard_tic_mode, labels, frame):
+	"""@brief Decode one frame in a MultiMeterReader pool worker process
+
+	@param standard_tic_mode The TIC mode of the meter
+	@param labels The label whitelist of the meter (as a tuple), or None
+	@param frame The raw TIC frame (without STX/ETX bytes), as a string
+	@return A tuple (extra labels, values, counters) where values are ordered like a fresh TICFrames record, extra labels are the labels of the values beyond that (labels unknown to our schema), and counters are the increments of the TICFrames counters
+	"""
+	key = (standard_tic_mode, labels)
+	if key not in _worker_tic_frames:
+		tic_frames = TICFrames(tic_link_frame_fetcher=None, standard_tic_mode=standard_tic_mode, labels=labels)
+		_worker_tic_frames[key] = (tic_frames, len(tic_frames._record_index))
+	(tic_frames, nb_base_labels) = _worker_tic_frames[key]
+	record = tic_frames.decode_frame(frame)
+	extra_labels = ()
+	if len(tic_frames._record_index) > nb_base_labels:
+		extra_labels = tuple(sorted(tic_frames._record_index, key=tic_frames._record_index.get)[nb_base_labels:])
+	return (extra_labels, record._values, record.counters)
+
+class MultiMeterReader:
+	"""@brief Reader of several Linky meters (each on its own serial port) from a single poll() loop
+
+	Frames are tagged with the ID of the meter they come from. Decoding can optionally be spread across a pool of processes.
+	"""
+	def __init__(self, nb_decoding_processes=0):
+		"""@brief Create a reader without any meter
+
+		@param nb_decoding_processes If non-zero, frames are decoded by a pool of this many processes instead of the reading process (useful with many meters on a multi-core board)
+		"""
+		self.meters = collections.OrderedDict()	# Meter state dicts, indexed by meter ID
+		self._meters_by_fileno = {}
+		self._poller = select.poll()
+		self._pool = None
+		if nb_decoding_processes:
+			self._pool = multiprocessing.Pool(processes=nb_decoding_processes)
+		self._pending_results = collections.deque()	# Tuples (meter ID, reception time, AsyncResult) in reception order
+
+	def close(self):
+		"""@brief Stop the decoding processes (if any)
+		"""
+		if self._pool is not None:
+			self._pool.terminate()
+			self._pool = None
+
+	def add_meter(self, meter_id, phy_decoder, standard_tic_mode=False, labels=None):
+		"""@brief Start reading frames from a new meter
+
+		@param meter_id The ID that frames from this meter are tagged with
+		@param phy_decoder The non-blocking PhyDecoder connected to this meter
+		@param standard_tic_mode True if this meter uses "TIC standard" mode, False for "TIC historique"
+		@param labels An optional list of the only labels we are interested in for this meter (see TICFrames)
+		"""
+		assert meter_id not in self.meters
+		assert not phy_decoder.blocking
+		fileno = phy_decoder.fileno()
+		assert fileno is not None	# Replayed captures cannot be polled
+		self.meters[meter_id] = {
+			'phy_decoder': phy_decoder,
+			'link_decoder': TICLinkLayerDecoder(phy_decoder),
+			'tic_frames': TICFrames(tic_link_frame_fetcher=None, standard_tic_mode=standard_tic_mode, labels=labels),
+			'labels': None if labels is None else tuple(labels),
+			'nb_frames': 0,
+			'last_frame_time': None,
+			'avg_inter_frame_period': None,	# Exponential moving average, in seconds
+		}
+		self._meters_by_fileno[fileno] = meter_id
+		self._poller.register(fileno, select.POLLIN)
+
+	def _frame_received(self, meter_id, timestamp):
+		"""@brief Update the statistics of a meter for a new frame
+		"""
+		meter = self.meters[meter_id]
+		meter['nb_frames'] += 1
+		if meter['last_frame_time'] is not None:
+			period = timestamp - meter['last_frame_time']
+			if meter['avg_inter_frame_period'] is None:
+				meter['avg_inter_frame_period'] = period
+			else:
+				meter['avg_inter_frame_period'] += (period - meter['avg_inter_frame_period']) / 16.0
+		meter['last_frame_time'] = timestamp
+
+	def _record_from_worker(self, meter_id, result):
+		"""@brief Build a TICFrame in this process from the result of _decode_frame_in_worker()
+		"""
+		(extra_labels, values, counters) = result
+		tic_frames = self.meters[meter_id]['tic_frames']
+		tic_frames.add_counters(counters)
+		record_index = tic_frames._record_index
+		if extra_labels:
+			nb_base_labels = len(values) - len(extra_labels)
+			extra_values = values[nb_base_labels:]
+			values = values[:nb_base_labels] + [None] * (len(record_index) - nb_base_labels)
+			for (label, value) in zip(extra_labels, extra_values):
+				if label not in record_index:	# Label unknown to our schema, keep it as a string like TICFrames.decode_frame() does
+					tic_frames._converters[label] = TICSchema.to_string
+					record_index[label] = len(record_index)
+					values.append(None)
+				values[record_index[label]] = value
+		elif len(values) < len(record_index):	# Another worker has already seen labels unknown to our schema
+			values = values + [None] * (len(record_index) - len(values))
+		return TICFrame(record_index, values, counters)
+
+	def _collect_results(self, frames, timeout):
+		"""@brief Append the results of the decoding processes that are ready, in reception order
+
+		@param frames The list to append (meter ID, reception time, TICFrame) tuples to
+		@param timeout The maximum time to wait for the oldest result (in seconds), or None to wait forever
+		"""
+		if self._pending_results and not frames:
+			self._pending_results[0][2].wait(timeout)
+		while self._pending_results and self._pending_results[0][2].ready():
+			(meter_id, timestamp, result) = self._pending_results.popleft()
+			frames.append((meter_id, timestamp, self._record_from_worker(meter_id, result.get())))
+
+	def poll(self, timeout=None):
+		"""@brief Wait for incoming bytes on any meter, and decode all the frames they complete
+
+		@param timeout The maximum time to wait (in seconds), or None to wait forever
+		@return A list of tuples (meter ID, reception time, TICFrame), possibly empty if the timeout expired
+		"""
+		frames = []
+		if self._pending_results:	# Do not sleep on serial ports while decoded frames are on their way
+			events = self._poller.poll(0)
+		elif timeout is None:
+			events = self._poller.poll()
+		else:
+			events = self._poller.poll(timeout * 1000)
+		timestamp = time.time()
+		for (fileno, _) in events:
+			meter_id = self._meters_by_fileno[fileno]
+			meter = self.meters[meter_id]
+			for (buf, start, end) in meter['link_decoder'].iter_frame_spans():
+				self._frame_received(meter_id, timestamp)
+				if self._pool is None:
+					frames.append((meter_id, timestamp, meter['tic_frames'].decode_frame(buf, start, end)))
+				else:
+					args = (meter['tic_frames'].standard_tic_mode, meter['labels'], memoryview(buf)[start:end].tobytes())	# Frames are sent to the pool as strings
+					self._pending_results.append((meter_id, timestamp, self._pool.apply_async(_decode_frame_in_worker, args)))
+		if self._pool is not None:
+			self._collect_results(frames, timeout)
+		return frames
+
+	def __iter__(self):
+		"""@brief Forever loop returning tuples (meter ID, reception time, TICFrame) as frames are received
+		"""
+		while True:
+			for tagged_frame in self.poll():
+				yield tagged_frame
+
+	def get_stats(self):
+		"""@brief Get the statistics of each meter
+
+		@return A dict of statistics dicts, indexed by meter ID
+		"""
+		stats = collections.OrderedDict()
+		for (meter_id, meter) in self.meters.items():
+			tic_frames = meter['tic_frames']
+			stats[meter_id] = {
+				'nb_frames': meter['nb_frames'],
+				'avg_inter_frame_period': meter['avg_inter_frame_period'],
+				'last_frame_time': meter['last_frame_time'],
+				'nb_resyncs': meter['link_decoder'].nb_resyncs,
+				'nb_datasets_decoded': tic_frames.nb_datasets_decoded,
+				'nb_checksum_errors': tic_frames.nb_checksum_errors,
+				'nb_invalid_values': tic_frames.nb_invalid_values,
+				'nb_malformed_datasets': tic_frames.nb_malformed_datasets,
+			}
+		return stats
 
 class LinkyHorodate:
 	"""@brief Class for parsing Linky TIC horodate
@@ -210,65 +1601,354 @@ class LinkyHorodate:
 		self.minute = minute
 		self.seconde = seconde
 
-	def __repr__(self):
-		return 'LinkyHorodate(' + 'saison=' + str(self.saison) + ',' + 'date=' + str(self.jour) + '/' + str(self.mois) + '/' + str(self.annee) + ',' + 'heure=' + str(self.heure) + ':' + str(self.minute) + ':' + str(seconde) + ')'
+	def __eq__(self, other):
+		return isinstance(other, LinkyHorodate) and \
+		       (self.saison, self.annee, self.mois, self.jour, self.heure, self.minute, self.seconde) == (other.saison, other.annee, other.mois, other.jour, other.heure, other.minute, other.seconde)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __repr__(self):
+		return 'LinkyHorodate(' + 'saison=' + str(self.saison) + ',' + 'date=' + str(self.jour) + '/' + str(self.mois) + '/' + str(self.annee) + ',' + 'heure=' + str(self.heure) + ':' + str(self.minute) + ':' + str(self.seconde) + ')'
+
+	@staticmethod
+	def from_horodate_string(input):
+		assert isinstance(input, str)
+		assert len(input) == 13
+		return LinkyHorodate(saison=input[0],
+		                     annee=2000+int(input[1:3]),
+		                     mois=int(input[3:5]),
+		                     jour=int(input[5:7]),
+		                     heure=int(input[7:9]),
+		                     minute=int(input[9:11]),
+		                     seconde=int(input[11:13]))
+
+class LinkyStatusRegister:
+	"""@brief Class for decoding the Linky TIC status register (STGE label, "TIC standard" only)
+	"""
+	def __init__(self, value):
+		"""@brief Constructor
+
+		@param value The 32-bit register value
+		"""
+		self.value = value
+
+	def __repr__(self):
+		return 'LinkyStatusRegister(0x%08X)' % self.value
+
+	def __eq__(self, other):
+		return isinstance(other, LinkyStatusRegister) and self.value == other.value
+
+	def __ne__(self, other):
+		return not self == other
+
+	def _bits(self, first_bit, nb_bits):
+		return (self.value >> first_bit) & ((1 << nb_bits) - 1)
+
+	@property
+	def contact_sec_open(self):
+		return self._bits(0, 1) == 1
+
+	@property
+	def organe_coupure(self):
+		return self._bits(1, 3)
+
+	@property
+	def surtension(self):
+		return self._bits(6, 1) == 1
+
+	@property
+	def depassement_puissance_ref(self):
+		return self._bits(7, 1) == 1
+
+	@property
+	def producteur(self):
+		return self._bits(8, 1) == 1
+
+	@property
+	def injecting(self):
+		"""@return True if active energy is negative (injected on the grid)
+		"""
+		return self._bits(9, 1) == 1
+
+	@property
+	def tarif_fourniture(self):
+		"""@return The current supplier tariff index (1 to 10)
+		"""
+		return self._bits(10, 4) + 1
+
+	@property
+	def tarif_distributeur(self):
+		"""@return The current distributor tariff index (1 to 4)
+		"""
+		return self._bits(14, 2) + 1
+
+	@property
+	def tic_standard(self):
+		return self._bits(17, 1) == 1
+
+	@property
+	def couleur_jour(self):
+		"""@return The Tempo color of the day (0: no info, 1: blue, 2: white, 3: red)
+		"""
+		return self._bits(24, 2)
+
+	@property
+	def couleur_lendemain(self):
+		"""@return The Tempo color of the next day (0: no info, 1: blue, 2: white, 3: red)
+		"""
+		return self._bits(26, 2)
+
+	@staticmethod
+	def from_hex_string(input):
+		assert isinstance(input, str)
+		return LinkyStatusRegister(int(input, 16))
+
+class TICSchema:
+	"""@brief Types of the values carried by each TIC label, and the converters to decode them
+	"""
+	INT = 'int'
+	STRING = 'string'
+	HORODATE = 'horodate'	# Labels only carrying a horodate (the value field is empty)
+	REGISTER = 'register'
+
+	STANDARD_LABEL_TYPES = {
+		'ADSC': STRING, 'VTIC': STRING, 'DATE': HORODATE, 'NGTF': STRING, 'LTARF': STRING,
+		'EAST': INT,
+		'EASF01': INT, 'EASF02': INT, 'EASF03': INT, 'EASF04': INT, 'EASF05': INT,
+		'EASF06': INT, 'EASF07': INT, 'EASF08': INT, 'EASF09': INT, 'EASF10': INT,
+		'EASD01': INT, 'EASD02': INT, 'EASD03': INT, 'EASD04': INT,
+		'EAIT': INT, 'ERQ1': INT, 'ERQ2': INT, 'ERQ3': INT, 'ERQ4': INT,
+		'IRMS1': INT, 'IRMS2': INT, 'IRMS3': INT,
+		'URMS1': INT, 'URMS2': INT, 'URMS3': INT,
+		'PREF': INT, 'PCOUP': INT,
+		'SINSTS': INT, 'SINSTS1': INT, 'SINSTS2': INT, 'SINSTS3': INT,
+		'SMAXSN': INT, 'SMAXSN1': INT, 'SMAXSN2': INT, 'SMAXSN3': INT,
+		'SMAXSN-1': INT, 'SMAXSN1-1': INT, 'SMAXSN2-1': INT, 'SMAXSN3-1': INT,
+		'SINSTI': INT, 'SMAXIN': INT, 'SMAXIN-1': INT,
+		'CCASN': INT, 'CCASN-1': INT, 'CCAIN': INT, 'CCAIN-1': INT,
+		'UMOY1': INT, 'UMOY2': INT, 'UMOY3': INT,
+		'STGE': REGISTER,
+		'DPM1': INT, 'FPM1': INT, 'DPM2': INT, 'FPM2': INT, 'DPM3': INT, 'FPM3': INT,
+		'MSG1': STRING, 'MSG2': STRING, 'PRM': STRING,
+		'RELAIS': INT, 'NTARF': INT, 'NJOURF': INT, 'NJOURF+1': INT,
+		'PJOURF+1': STRING, 'PPOINTE': STRING,
+	}
+
+	HISTORIQUE_LABEL_TYPES = {
+		'ADCO': STRING, 'OPTARIF': STRING, 'ISOUSC': INT,
+		'BASE': INT, 'HCHC': INT, 'HCHP': INT, 'EJPHN': INT, 'EJPHPM': INT,
+		'BBRHCJB': INT, 'BBRHPJB': INT, 'BBRHCJW': INT, 'BBRHPJW': INT, 'BBRHCJR': INT, 'BBRHPJR': INT,
+		'PEJP': INT, 'PTEC': STRING, 'DEMAIN': STRING,
+		'IINST': INT, 'IINST1': INT, 'IINST2': INT, 'IINST3': INT,
+		'ADPS': INT, 'IMAX': INT, 'IMAX1': INT, 'IMAX2': INT, 'IMAX3': INT,
+		'PMAX': INT, 'PAPP': INT, 'HHPHC': STRING, 'MOTDETAT': STRING, 'PPOT': STRING,
+		'ADIR1': INT, 'ADIR2': INT, 'ADIR3': INT,
+	}
+
+	@staticmethod
+	def to_int(value):
+		"""@return The value as an int, or None if it is not a number
+		"""
+		if value.isdigit():
+			return int(value)
+		return None
+
+	@staticmethod
+	def to_string(value):
+		return value
+
+	@staticmethod
+	def to_horodate(value):
+		"""@return The value as a LinkyHorodate, or None if it is not a valid horodate
+		"""
+		if len(value) != 13 or not value[1:].isdigit():
+			return None
+		return LinkyHorodate.from_horodate_string(value)
+
+	@staticmethod
+	def to_register(value):
+		"""@return The value as a LinkyStatusRegister, or None if it is not an hexadecimal number
+		"""
+		if len(value) == 0 or value.strip('0123456789abcdefABCDEF'):
+			return None
+		return LinkyStatusRegister.from_hex_string(value)
+
+	@staticmethod
+	def get_label_types(standard_tic_mode):
+		"""@return A dict containing the type of each label in the given TIC mode
+		"""
+		if standard_tic_mode:
+			return TICSchema.STANDARD_LABEL_TYPES
+		else:
+			return TICSchema.HISTORIQUE_LABEL_TYPES
+
+	@staticmethod
+	def get_converters(standard_tic_mode, labels):
+		"""@brief Resolve the converter of each label
+
+		@param standard_tic_mode True for "TIC standard" mode, False for "TIC historique" mode
+		@param labels The labels we want a converter for (unknown labels are kept as strings)
+		@return A dict containing the converter function of each label
+		"""
+		converter_per_type = {TICSchema.INT: TICSchema.to_int,
+		                      TICSchema.STRING: TICSchema.to_string,
+		                      TICSchema.HORODATE: TICSchema.to_horodate,
+		                      TICSchema.REGISTER: TICSchema.to_register}
+		label_types = TICSchema.get_label_types(standard_tic_mode)
+		return dict((label, converter_per_type[label_types.get(label, TICSchema.STRING)]) for label in labels)
+
+class HistoryBarsView:
+	"""@brief Read-only view on the bars of a FixedWidthHistoryBarGraph
+
+	The view always reflects the current content of the graph, and reading one bar does not copy anything.
+	"""
+	def __init__(self, graph, percent=False):
+		"""@brief Constructor
+
+		@param graph The FixedWidthHistoryBarGraph to read from
+		@param percent If True, bars are scaled to a percentage of the graph maximum value
+		"""
+		self._graph = graph
+		if percent:
+			self._get_item = graph.get_percent_item
+		else:
+			self._get_item = graph.get_item
 
-	@staticmethod
-	def from_horodate_string(input):
-		assert isinstance(input, str)
-		assert len(input) == 13
-		return LinkyHorodate(saison=input[0],
-		                     annee=2000+int(input[1:3]),
-		                     mois=int(input[3:5]),
-		                     jour=int(input[5:7]),
-		                     heure=int(input[7:9]),
-		                     minute=int(input[9:11]),
-		                     seconde=int(input[11:13]))
+	def __len__(self):
+		graph = self._graph
+		if graph.scale_up_factor is not None:
+			return min(graph.nb_items * graph.scale_up_factor, graph.width)
+		return graph.nb_items
+
+	def __getitem__(self, index):
+		nb_bars = len(self)
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(nb_bars))]
+		if index < 0:
+			index += nb_bars
+		if index < 0 or index >= nb_bars:
+			raise IndexError('bar index out of range')
+		graph = self._graph
+		if graph.scale_up_factor is not None:	# Each stored sample is displayed as several bars
+			index = (graph.nb_items * graph.scale_up_factor - nb_bars + index) // graph.scale_up_factor
+		return self._get_item(index)
+
+	def __iter__(self):
+		for index in range(len(self)):
+			yield self[index]
 
 class FixedWidthHistoryBarGraph:
 	"""@brief Database storing history of values
 
 	The values in database can be converted to a fixed-width bar graph, for graphical display
+	Values are stored in a preallocated ring buffer, so appending a value and reading a bar are constant-time operations.
+	Missing values are stored as None.
+	The maximum value of the graph is tracked incrementally using a monotonic queue, and percentages are computed lazily when a bar is read.
+	They are cached until the maximum changes.
 	"""
 	def __init__(self, width, history_requested_size):
 		self.width = width
 		if history_requested_size <= width:	# We should scale up bar graph (this is not very good-looking, but...)
 			self.scale_up_factor = width // history_requested_size
 			self.scale_down_factor = None
-			self.history_max_size = width * self.scale_up_factor
+			self.history_max_size = (width + self.scale_up_factor - 1) // self.scale_up_factor	# Enough samples to fill the whole width
 			print('Scaling up, each sample will be displayed with ' + str(self.scale_up_factor) + ' lines')
 		else:
 			# We will scale down, averaging several values into one bar graph line
 			self.scale_down_factor = history_requested_size // width
 			if history_requested_size % width != 0: # There is a remainder, round to the next higher integer
 				self.scale_down_factor += 1
-			self.accumulated_values_for_scale_down = []
+			self._nb_accumulated_values = 0	# Running sum of the values received for the bar being built
+			self._nb_valid_accumulated_values = 0
+			self._accumulated_sum = 0
 			self.scale_up_factor = None
-			self.history_max_size = width * self.scale_down_factor
+			self.history_max_size = width
 			print('Scaling down, each line will be the average of ' + str(self.scale_down_factor) + ' samples')
-		self.history = []
+		self._ring = [None] * self.history_max_size
+		self._ring_next = 0	# Position in the ring where the next item will be written
+		self.nb_items = 0	# Number of valid items in the ring
+		self._nb_appended_items = 0	# Total number of items ever written to the ring, used as a sequence number
+		self._max_candidates = collections.deque()	# Tuples (sequence number, value) of the items that may become the maximum, values in decreasing order
+		self.max_value = 0	# Maximum value in the ring (0 if there is no value)
+		self._max_generation = 0	# Incremented each time max_value changes
+		self._percents = [None] * self.history_max_size	# Cache of percentages for each item in the ring
+		self._percents_generation = [-1] * self.history_max_size	# Value of _max_generation when each cached percentage was computed
+		self.bars = HistoryBarsView(self)	# The last width bars of the graph
+		self.percent_bars = HistoryBarsView(self, percent=True)	# The last width bars of the graph, scaled to a percentage of max_value
 
 	def append(self, value):
-		if self.scale_up_factor is not None:	# Scaling up
-			self.history.append(value)	# Just add the raw value
-		elif self.scale_down_factor is not None:	# Scaling down
-			self.accumulated_values_for_scale_down.append(value)
-			if len(self.accumulated_values_for_scale_down) >= self.scale_down_factor:	# We have enough samples to perform the average and scale down
-				accumulated = self.accumulated_values_for_scale_down[:self.scale_down_factor]
-				self.accumulated_values_for_scale_down = []	# Empty our incoming buffer
-				nb_valid_values = 0
-				sum = 0
-				for i in accumulated:
-					if i is not None:
-						nb_valid_values += 1
-						sum += i
-				if nb_valid_values == 0:
-					value = None
-				else:
-					value = sum // nb_valid_values
-				self.history.append(value)
-		if len(self.history) > self.history_max_size:
-			self.history = self.history[len(self.history)-self.history_max_size:]
+		if self.scale_down_factor is not None:	# Scaling down
+			self._nb_accumulated_values += 1
+			if value is not None:
+				self._nb_valid_accumulated_values += 1
+				self._accumulated_sum += value
+			if self._nb_accumulated_values < self.scale_down_factor:
+				return	# We don't have enough samples yet to perform the average and scale down
+			if self._nb_valid_accumulated_values == 0:
+				value = None
+			else:
+				value = self._accumulated_sum // self._nb_valid_accumulated_values
+			self._nb_accumulated_values = 0	# Empty our incoming buffer
+			self._nb_valid_accumulated_values = 0
+			self._accumulated_sum = 0
+		self._ring[self._ring_next] = value
+		self._percents_generation[self._ring_next] = -1
+		self._update_max(value)
+		self._ring_next += 1
+		if self._ring_next == self.history_max_size:
+			self._ring_next = 0
+		if self.nb_items < self.history_max_size:
+			self.nb_items += 1
+
+	def _update_max(self, value):
+		"""@brief Update max_value with a value that is being written in the ring
+		"""
+		seq = self._nb_appended_items
+		self._nb_appended_items += 1
+		candidates = self._max_candidates
+		while candidates and candidates[0][0] <= seq - self.history_max_size:	# This item has just been overwritten in the ring
+			candidates.popleft()
+		if value is not None:
+			while candidates and candidates[-1][1] <= value:	# These items can never become the maximum again
+				candidates.pop()
+			candidates.append((seq, value))
+		if candidates:
+			max_value = candidates[0][1]
+		else:
+			max_value = 0
+		if max_value != self.max_value:
+			self.max_value = max_value
+			self._max_generation += 1	# All cached percentages are now obsolete
+
+	def get_percent_item(self, index):
+		"""@brief Get one item from the history, scaled to a percentage of max_value
+
+		@param index The index of the item, 0 being the oldest item
+		@return The percentage (None for a missing value)
+		"""
+		pos = (self._ring_next - self.nb_items + index) % self.history_max_size
+		if self._percents_generation[pos] != self._max_generation:
+			value = self._ring[pos]
+			if value is not None and self.max_value != 0:
+				value = (value * 100) // self.max_value
+			self._percents[pos] = value
+			self._percents_generation[pos] = self._max_generation
+		return self._percents[pos]
+
+	def get_item(self, index):
+		"""@brief Get one item from the history
+
+		@param index The index of the item, 0 being the oldest item
+		@return The item (None for a missing value)
+		"""
+		return self._ring[(self._ring_next - self.nb_items + index) % self.history_max_size]
+
+	@property
+	def history(self):
+		"""@return A list of all the items in the history, from the oldest to the most recent one
+		"""
+		return [self.get_item(index) for index in range(self.nb_items)]
 
 	def get_nb_history_items_for_input_values(self, nb_input_values):
 		"""@brief Return the number of output history items matching with a given number of input values
@@ -281,13 +1961,370 @@ class FixedWidthHistoryBarGraph:
 			return None
 
 	def to_fixed_width_list(self):
-		if self.scale_up_factor is not None:	# Scaling up
-			result = []
-			for i in self.history:
-				result += [i] * self.scale_up_factor
-			return result
-		else:	# History is already ready
-			return self.history
+		"""@return A new list containing the last width bars of the graph (see the bars attribute for a view that does not copy anything)
+		"""
+		return list(self.bars)
+
+class HistoryTier:
+	"""@brief One resolution level of a MultiResolutionHistory
+
+	Samples are aggregated into fixed-duration buckets (keeping min, sum and max), and closed buckets are stored in a ring buffer.
+	"""
+	def __init__(self, resolution, capacity):
+		"""@brief Constructor
+
+		@param resolution The duration of one bucket (in seconds)
+		@param capacity The number of closed buckets we keep
+		"""
+		self.resolution = resolution
+		self.capacity = capacity
+		self._starts = [None] * capacity
+		self._mins = [None] * capacity
+		self._maxs = [None] * capacity
+		self._sums = [0] * capacity
+		self._counts = [0] * capacity
+		self._ring_next = 0	# Position in the ring where the next bucket will be written
+		self.nb_items = 0	# Number of closed buckets in the ring
+		self._current_start = None	# Start timestamp of the bucket being built
+		self._current_min = None
+		self._current_max = None
+		self._current_sum = 0
+		self._current_count = 0
+		self._listeners = []
+
+	def add_listener(self, listener):
+		"""@brief Register a callback invoked for each closed bucket (including empty buckets)
+
+		@param listener A function taking arguments (start, minimum, maximum, total, count)
+		"""
+		self._listeners.append(listener)
+
+	def add(self, timestamp, minimum, maximum, total, count):
+		"""@brief Merge an aggregate (a single sample or a bucket from a finer tier) into this tier
+
+		@param timestamp The time of the aggregate (in seconds)
+		@param minimum The minimum value of the aggregate (None if count is 0)
+		@param maximum The maximum value of the aggregate (None if count is 0)
+		@param total The sum of the values of the aggregate
+		@param count The number of samples in the aggregate (0 only moves the time forward)
+		"""
+		start = int(timestamp) // self.resolution * self.resolution
+		if self._current_start is None:
+			self._current_start = start
+		elif start > self._current_start:	# The bucket being built is now over
+			nb_missing_buckets = (start - self._current_start) // self.resolution - 1
+			self._close_current()
+			for missing_start in range(start - min(nb_missing_buckets, self.capacity) * self.resolution, start, self.resolution):	# Buckets without any sample
+				self._push(missing_start, None, None, 0, 0)
+			self._current_start = start
+		if count == 0:
+			return
+		if self._current_count == 0:
+			self._current_min = minimum
+			self._current_max = maximum
+		else:
+			if minimum < self._current_min:
+				self._current_min = minimum
+			if maximum > self._current_max:
+				self._current_max = maximum
+		self._current_sum += total
+		self._current_count += count
+
+	def _close_current(self):
+		self._push(self._current_start, self._current_min, self._current_max, self._current_sum, self._current_count)
+		self._current_min = None
+		self._current_max = None
+		self._current_sum = 0
+		self._current_count = 0
+
+	def _push(self, start, minimum, maximum, total, count):
+		pos = self._ring_next
+		self._starts[pos] = start
+		self._mins[pos] = minimum
+		self._maxs[pos] = maximum
+		self._sums[pos] = total
+		self._counts[pos] = count
+		self._ring_next = pos + 1
+		if self._ring_next == self.capacity:
+			self._ring_next = 0
+		if self.nb_items < self.capacity:
+			self.nb_items += 1
+		for listener in self._listeners:
+			listener(start, minimum, maximum, total, count)
+
+	def get_bucket(self, index):
+		"""@brief Get one closed bucket
+
+		@param index The index of the bucket, 0 being the oldest bucket
+		@return A tuple (start, minimum, average, maximum), values being None for an empty bucket
+		"""
+		pos = (self._ring_next - self.nb_items + index) % self.capacity
+		count = self._counts[pos]
+		if count == 0:
+			return (self._starts[pos], None, None, None)
+		return (self._starts[pos], self._mins[pos], self._sums[pos] // count, self._maxs[pos])
+
+	def iter_buckets(self):
+		"""@return A generator of all closed buckets, from the oldest to the most recent one (see get_bucket())
+		"""
+		for index in range(self.nb_items):
+			yield self.get_bucket(index)
+
+class MultiResolutionHistory:
+	"""@brief History of values at several resolutions (1s, 1min, 15min, 1 day)
+
+	Each tier is incrementally rolled up into the next coarser tier, and each view is a FixedWidthHistoryBarGraph fed with the closed buckets of one tier.
+	Switching between views thus does not require rescanning any sample.
+	"""
+	TIERS = [(1, 15*60), (60, 24*60), (15*60, 30*24*4), (24*60*60, 366)]	# (resolution in s, number of buckets kept)
+	VIEWS = [('15min', 1, 15*60, 5*60),	# (name, tier resolution in s, displayed duration in s, period of vertical time markers in s)
+	         ('24h', 60, 24*60*60, 6*60*60),
+	         ('30days', 15*60, 30*24*60*60, 7*24*60*60)]
+
+	def __init__(self, width, tiers=TIERS, views=VIEWS):
+		"""@brief Constructor
+
+		@param width The width of the bar graph of each view
+		@param tiers A list of tuples (resolution, capacity) describing each tier, from the finest to the coarsest resolution
+		@param views A list of tuples (name, tier resolution, displayed duration, time marker period) describing each view
+		"""
+		required_capacities = {}	# Each tier must be able to represent a gap covering the whole graph of its views
+		for (name, resolution, duration, time_marker_period) in views:
+			nb_samples = duration // resolution
+			required_capacities[resolution] = max(required_capacities.get(resolution, 0), -(-nb_samples // width) * width)
+		self.tiers = [HistoryTier(resolution=resolution, capacity=max(capacity, required_capacities.get(resolution, 0))) for (resolution, capacity) in tiers]
+		for (finer_tier, coarser_tier) in zip(self.tiers, self.tiers[1:]):
+			finer_tier.add_listener(coarser_tier.add)
+		self.views = {}
+		self._time_marker_periods = {}
+		self._durations = {}
+		for (name, resolution, duration, time_marker_period) in views:
+			tier = self.get_tier(resolution)
+			graph = FixedWidthHistoryBarGraph(width=width, history_requested_size=duration // resolution)
+			tier.add_listener(lambda start, minimum, maximum, total, count, graph=graph: graph.append(None if count == 0 else total // count))
+			self.views[name] = (tier, graph)
+			self._time_marker_periods[name] = time_marker_period
+			self._durations[name] = duration
+		self.current_view = views[0][0]
+
+	def get_tier(self, resolution):
+		"""@return The tier with the given resolution (in seconds)
+		"""
+		for tier in self.tiers:
+			if tier.resolution == resolution:
+				return tier
+		raise ValueError('No history tier with resolution ' + str(resolution) + 's')
+
+	def append(self, value, timestamp):
+		"""@brief Add a new sample
+
+		@param value The sample value, or None if the reading failed (this only moves the time forward)
+		@param timestamp The time of the sample (in seconds)
+		"""
+		if value is None:
+			self.tiers[0].add(timestamp, None, None, 0, 0)
+		else:
+			self.tiers[0].add(timestamp, value, value, value, 1)
+
+	def select_view(self, name):
+		"""@brief Select the view returned by get_view() when no name is provided
+		"""
+		if name not in self.views:
+			raise ValueError('Unknown history view ' + str(name))
+		self.current_view = name
+
+	def get_view(self, name=None):
+		"""@return The FixedWidthHistoryBarGraph of a view (the current view if name is None)
+		"""
+		if name is None:
+			name = self.current_view
+		return self.views[name][1]
+
+	def get_time_marker_interval(self, name=None):
+		"""@return The number of bars between two vertical time markers on the graph of a view (the current view if name is None)
+		"""
+		if name is None:
+			name = self.current_view
+		(tier, graph) = self.views[name]
+		return graph.get_nb_history_items_for_input_values(self._time_marker_periods[name] // tier.resolution)
+
+	def get_view_duration(self, name=None):
+		"""@return The duration (in seconds) displayed by a view (the current view if name is None)
+		"""
+		if name is None:
+			name = self.current_view
+		return self._durations[name]
+
+class TimeSeriesStore:
+	"""@brief Append-only on-disk store of integer TIC values (eg: SINSTS, IRMS1, URMS1), one file per day (UTC)
+
+	Each file starts with a header listing the stored labels, followed by fixed-size records (timestamp, then one signed 32-bit value per label).
+	Reads go through mmap() and a binary search on timestamps, so that long ranges can be scanned without loading whole files.
+	"""
+	HEADER = struct.Struct('<4sH64s')	# Magic, format version, comma-separated labels
+	MAGIC = b'LTSS'
+	VERSION = 1
+	MISSING_VALUE = -2**31	# Stored in place of a missing (None) value
+	FILE_SUFFIX = '.tss'
+
+	def __init__(self, directory, labels):
+		"""@brief Open a store (the directory is created if needed)
+
+		@param directory The directory holding the daily files
+		@param labels The list of labels stored in each record (their values must be integers)
+		"""
+		self.directory = directory
+		self.labels = tuple(labels)
+		self._encoded_labels = ','.join(self.labels).encode('ascii')
+		if len(self._encoded_labels) > 64:
+			raise ValueError('Too many labels in time series store')
+		self.record = struct.Struct('<d' + 'i' * len(self.labels))
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self._file = None	# File of the current day, opened for appending
+		self._file_day = None
+		self._last_timestamp = None	# Timestamp of the last record in self._file
+		self.nb_records_dropped = 0	# Number of records dropped because their timestamp went back in time
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+			self._file_day = None
+
+	def _get_path(self, day):
+		"""@return The path of the file storing a day (given as a number of days since epoch)
+		"""
+		return os.path.join(self.directory, time.strftime('%Y-%m-%d', time.gmtime(day * 86400)) + self.FILE_SUFFIX)
+
+	def _list_days(self):
+		"""@return The sorted list of days (as numbers of days since epoch) having a file in the store
+		"""
+		days = []
+		for filename in os.listdir(self.directory):
+			if filename.endswith(self.FILE_SUFFIX):
+				try:
+					day_start = datetime.datetime.strptime(filename[:-len(self.FILE_SUFFIX)], '%Y-%m-%d') - datetime.datetime(1970, 1, 1)
+				except ValueError:
+					continue
+				days.append(day_start.days)
+		return sorted(days)
+
+	def _check_header(self, header, path):
+		(magic, version, encoded_labels) = self.HEADER.unpack(header)
+		if magic != self.MAGIC or version != self.VERSION:
+			raise ValueError(path + ' is not a time series store file')
+		if encoded_labels.rstrip(b'\0') != self._encoded_labels:
+			raise ValueError(path + ' stores different labels: ' + encoded_labels.rstrip(b'\0'))
+
+	def _open_day(self, day):
+		"""@brief Open the file of a day for appending, creating it or dropping a partially written last record if needed
+		"""
+		self.close()
+		path = self._get_path(day)
+		self._last_timestamp = None
+		if os.path.exists(path) and os.path.getsize(path) >= self.HEADER.size:
+			self._file = open(path, 'r+b')
+			self._check_header(self._file.read(self.HEADER.size), path)
+			nb_records = (os.path.getsize(path) - self.HEADER.size) // self.record.size
+			end = self.HEADER.size + nb_records * self.record.size
+			self._file.truncate(end)
+			if nb_records:
+				self._file.seek(end - self.record.size)
+				self._last_timestamp = self.record.unpack(self._file.read(self.record.size))[0]
+			self._file.seek(end)
+		else:	# New file, or a file whose header was never fully written (eg: power cut just after its creation), nothing to keep
+			self._file = open(path, 'wb')
+			self._file.write(self.HEADER.pack(self.MAGIC, self.VERSION, self._encoded_labels))
+			self._file.flush()	# The header is on disk even if no record is ever appended
+		self._file_day = day
+
+	def append(self, timestamp, values):
+		"""@brief Append one record
+
+		@param timestamp The time of the record (in seconds since epoch)
+		@param values The values of the record, one per label (None for a missing value)
+		"""
+		day = int(timestamp) // 86400
+		if day != self._file_day:
+			self._open_day(day)
+		if self._last_timestamp is not None and timestamp < self._last_timestamp:	# Records are kept sorted for binary searches
+			self.nb_records_dropped += 1
+			return
+		self._file.write(self.record.pack(timestamp, *[self.MISSING_VALUE if value is None else value for value in values]))
+		self._file.flush()
+		self._last_timestamp = timestamp
+
+	def _find_record(self, mapped, nb_records, timestamp):
+		"""@brief Binary search of the first record not older than timestamp in a mapped file
+
+		@return The index of the record (nb_records if all records are older)
+		"""
+		(low, high) = (0, nb_records)
+		header_size = self.HEADER.size
+		record_size = self.record.size
+		while low < high:
+			middle = (low + high) // 2
+			if struct.unpack_from('<d', mapped, header_size + middle * record_size)[0] < timestamp:
+				low = middle + 1
+			else:
+				high = middle
+		return low
+
+	def query(self, start, end):
+		"""@brief Get the records in a time range
+
+		Files are mapped in memory one at a time, and records are only unpacked as the generator is consumed.
+
+		@param start The start of the range (in seconds since epoch, included)
+		@param end The end of the range (in seconds since epoch, excluded)
+		@return A generator of tuples (timestamp, values), values being a tuple with one value (or None) per label
+		"""
+		if self._file is not None:
+			self._file.flush()
+		missing = self.MISSING_VALUE
+		unpack_from = self.record.unpack_from
+		record_size = self.record.size
+		header_size = self.HEADER.size
+		for day in self._list_days():
+			if (day + 1) * 86400 <= start or day * 86400 >= end:
+				continue
+			path = self._get_path(day)
+			with open(path, 'rb') as day_file:
+				nb_records = (os.path.getsize(path) - header_size) // record_size
+				if nb_records <= 0:
+					continue
+				mapped = mmap.mmap(day_file.fileno(), header_size + nb_records * record_size, access=mmap.ACCESS_READ)
+				try:
+					self._check_header(mapped[:header_size], path)
+					index = self._find_record(mapped, nb_records, start)
+					offset = header_size + index * record_size
+					while index < nb_records:
+						record = unpack_from(mapped, offset)
+						if record[0] >= end:
+							break
+						yield (record[0], tuple(None if value == missing else value for value in record[1:]))
+						index += 1
+						offset += record_size
+				finally:
+					mapped.close()
+
+	def restore_history(self, history, label, end=None):
+		"""@brief Rebuild the current view of a MultiResolutionHistory from the most recent records
+
+		@param history The MultiResolutionHistory to feed
+		@param label The label whose values are appended to the history
+		@param end The end of the restored range (now by default)
+		@return The number of records appended to the history
+		"""
+		if end is None:
+			end = time.time()
+		pos = self.labels.index(label)
+		nb_records = 0
+		for (timestamp, values) in self.query(end - history.get_view_duration(), end):
+			history.append(values[pos], timestamp=timestamp)
+			nb_records += 1
+		return nb_records
 
 class DisplayData:
 	"""@brief Data class storing all the data to display on the LCD screen
@@ -300,27 +2337,135 @@ class DisplayData:
 		self.beat = beat
 		self.vert_lines_freq = vert_lines_freq
 
-def list_scaled_to_percent(input):
-	max_value = 0
-	# First pass, we extract the maximum, ignoring None items
-	for i in input:
-		if i is not None and i>max_value:
-			max_value = i
-	# Second pass, we scale all values to 100%
-	if max_value == 0:
-		return (input, 0)
-	result = []
-	for i in input:
-		if i is None:
-			result.append(None)
-		else:
-			result.append((i*100)//max_value)
-	return (result, max_value)
+	def _key(self):
+		return (self.scaled_bar_graph, self.displayed_power, self.pflow_str, self.read_error, self.beat, self.vert_lines_freq)
+
+	def __eq__(self, other):
+		return isinstance(other, DisplayData) and self._key() == other._key()
+
+	def __ne__(self, other):
+		return not self == other
+
+class TextBitmapCache:
+	"""@brief Pre-rendered 1-bit bitmaps of the texts drawn with one font
+
+	Characters of the charset are rasterised once, and texts made of them are drawn by blitting their glyphs side by side.
+	Static strings (labels) and texts that cannot be composed glyph by glyph are rasterised as a whole, once.
+	This is the case of texts with characters outside of the charset, pairs of characters moved by kerning, or characters with a fractional advance anywhere but at the end of the text.
+	The result is pixel-identical to ImageDraw.text().
+	"""
+	DEFAULT_CHARSET = '0123456789+-.:;[]W' + 'Bilan' + 'None'	# Measurements, and the other characters of our dynamic texts
+	MAX_CACHED_TEXTS = 64	# Maximum number of non-static texts rasterised as a whole that we keep
+
+	def __init__(self, font, charset=DEFAULT_CHARSET, static_strings=()):
+		"""@brief Rasterise the glyphs of a charset and some static strings
+
+		@param font The PIL font
+		@param charset The characters that are rasterised individually
+		@param static_strings Strings that are rasterised as a whole, and never evicted from the cache
+		"""
+		self.font = font
+		self.margin = font.getsize('W')[1] // 2
+		self._glyphs = {}	# Tuples (bitmap, width, height) indexed by character
+		for char in charset:
+			self._glyphs[char] = self._rasterise(char)
+		self._last_only = set()	# Characters whose advance is not a whole number of pixels, that can only be composed at the end of a text
+		for char in charset:
+			if not self._is_composable(char * 3):
+				self._last_only.add(char)
+		self._kerned_pairs = set()	# Pairs of characters that are not drawn side by side
+		for first in self._glyphs:
+			for second in self._glyphs:
+				if font.getsize(first + second)[0] != self._glyphs[first][1] + self._glyphs[second][1]:
+					self._kerned_pairs.add(first + second)
+		self._static_texts = dict((text, self._rasterise(text)) for text in static_strings)
+		self._texts = collections.OrderedDict()	# Other texts rasterised as a whole, in least recently used order
+
+	def _rasterise(self, text):
+		"""@return A tuple (bitmap, width, height), bitmap being a mode '1' image with non-zero pixels where the text is drawn
+
+		The bitmap has a margin of self.margin pixels on its left and right, for glyphs overhanging their advance
+		"""
+		(width, height) = self.font.getsize(text)
+		bitmap = Image.new('1', (width + 2 * self.margin, max(height, 1)), 0)
+		ImageDraw.Draw(bitmap).text((self.margin, 0), text, font=self.font, fill=1)
+		return (bitmap, width, height)
+
+	def _is_composable(self, text):
+		"""@return True if drawing the glyphs of a text side by side gives the same pixels as drawing the whole text
+		"""
+		(bitmap, width, height) = self._rasterise(text)
+		composed = Image.new('1', bitmap.size, 0)
+		composed_drawer = ImageDraw.Draw(composed)
+		x = 0
+		for char in text:
+			(glyph_bitmap, glyph_width, glyph_height) = self._glyphs[char]
+			composed_drawer.bitmap((x, 0), glyph_bitmap, fill=1)
+			x += glyph_width
+		return x == width and composed.tobytes() == bitmap.tobytes()	# Bitmaps are drawn with their margin, so positions are all shifted by the margin
+
+	def _get_glyphs(self, text):
+		"""@return The list of glyphs (bitmap, width, height) to draw side by side to draw a text (possibly a single glyph of the whole text)
+		"""
+		glyph = self._static_texts.get(text)
+		if glyph is not None:
+			return [glyph]
+		glyphs = self._glyphs
+		try:
+			text_glyphs = [glyphs[char] for char in text]
+		except KeyError:	# Character outside of our charset
+			text_glyphs = None
+		if text_glyphs is not None and (self._kerned_pairs or self._last_only):
+			for pos in range(len(text) - 1):
+				if text[pos] in self._last_only or text[pos:pos+2] in self._kerned_pairs:
+					text_glyphs = None
+					break
+		if text_glyphs is not None:
+			return text_glyphs
+		glyph = self._texts.pop(text, None)
+		if glyph is None:
+			glyph = self._rasterise(text)
+			if len(self._texts) >= self.MAX_CACHED_TEXTS:
+				self._texts.popitem(last=False)
+		self._texts[text] = glyph
+		return [glyph]
+
+	def get_size(self, text):
+		"""@return The size (width, height) of a text, like ImageDraw.textsize()
+		"""
+		width = 0
+		height = 0
+		for (bitmap, glyph_width, glyph_height) in self._get_glyphs(text):
+			width += glyph_width
+			if glyph_height > height:
+				height = glyph_height
+		return (width, height)
+
+	def draw(self, image_drawer, xy, text, fill=0):
+		"""@brief Draw a text, like ImageDraw.text()
+
+		@param image_drawer The ImageDraw object of the target image
+		@param xy The top-left corner of the text
+		@param text The text to draw
+		@param fill The color of the text pixels
+		"""
+		(x, y) = xy
+		x -= self.margin
+		for (bitmap, glyph_width, glyph_height) in self._get_glyphs(text):
+			image_drawer.bitmap((x, y), bitmap, fill=fill)
+			x += glyph_width
 
 class LCDDisplay:
 	"""@brief Class driving an LCD display shield
+
+	The screen is made of widgets (texts, icon, and one widget per graph column).
+	Only the widgets whose inputs changed since the previous DisplayData are redrawn, together with the widgets they overlap.
+	Texts and the icon are blitted from bitmaps rendered once at construction.
 	"""
-	def __init__(self, image_displayer, lcd_width, lcd_height, top, font_small, font_big):
+	BANK_HEIGHT = 8	# The PCD8544 controller addresses its memory by horizontal banks of 8 pixel rows
+	ELEC_ICON_SIZE = (6, 11)
+
+	def __init__(self, image_displayer, lcd_width, lcd_height, top, font_small, font_big, partial_image_displayer=None):
 		"""@brief Constructor
 
 		@param image_displayer A callback function taking an Image object and displaying it to the LCD
@@ -329,11 +2474,15 @@ class LCDDisplay:
 		@param top The offset (in y coords) where we should start drawing, compared to the top of the screen
 		@param font_small A font to draw tiny text strings
 		@param font_big A font to draw big text strings (the withdrawn power measurement)
+		@param partial_image_displayer An optional callback function taking an Image object, a first and a last bank index (inclusive), and only displaying these banks to the LCD
 		"""
 		if not callable(image_displayer):
 			raise TypeError('image_displayer argument is not callable')
 		else:
 			self._image_displayer = image_displayer
+		if partial_image_displayer is not None and not callable(partial_image_displayer):
+			raise TypeError('partial_image_displayer argument is not callable')
+		self._partial_image_displayer = partial_image_displayer
 		self.lcd_width = lcd_width
 		self.lcd_height = lcd_height
 		# Make sure to create image with mode '1' for 1-bit color (B&W display)
@@ -343,62 +2492,552 @@ class LCDDisplay:
 		self.top = top
 		self.font_small = font_small
 		self.font_big = font_big
+		self._small_text = TextBitmapCache(font_small, static_strings=[self._get_title(False), self._get_title(True)])
+		self._big_text = TextBitmapCache(font_big)
+		self._elec_icon = Image.new('1', self.ELEC_ICON_SIZE, 0)
+		self._draw_elec_icon(ImageDraw.Draw(self._elec_icon), (0, 0), fill=1)
+		self.graph_xyxy = (0, self.top+31, self.lcd_width, self.lcd_height)
 		# Draw a white filled box to clear the image.
 		self.clear()
 
 	def clear(self):
+		"""@brief Clear the image, the next draw_to_image() will redraw everything
+		"""
 		self.image_drawer.rectangle((0, 0, self.lcd_width, self.lcd_height),
 		                            outline=255,
 		                            fill=255)
+		self._widget_inputs = {}	# Inputs used for the last drawing of each widget
+		self._widget_boxes = {}	# Box (x0, y0, x1, y1), exclusive of x1 and y1, containing all pixels of the last drawing of each widget
+		self._dirty_rows = (0, self.lcd_height - 1)	# Range of rows modified since the last display() (None if the image is unchanged)
 
 	def display(self):
-		self._image_displayer(self.image)
+		"""@brief Send the image to the LCD, if it was modified since the last call
 
-	def draw_to_image(self, display_data):
-		self.clear()
-		self.image_drawer.text((0, self.top+4), str(display_data.displayed_power) + 'W', font=self.font_big)
-		self.image_drawer.line((0, self.top+22, self.lcd_width, self.top+22), fill=0)
-		if pflow_str is not None:
-			self.image_drawer.text((0, self.top+23), 'Bilan:' + display_data.pflow_str + 'W', font=self.font_small)
-		if not display_data.read_error:
-			self.image_drawer.text((0, self.top), "Puissance soutiree", font=self.font_small)
+		If a partial_image_displayer was provided, only the modified banks are sent.
+		"""
+		if self._dirty_rows is None:
+			return	# The LCD is already up-to-date
+		(first_row, last_row) = self._dirty_rows
+		self._dirty_rows = None
+		if self._partial_image_displayer is not None and (first_row, last_row) != (0, self.lcd_height - 1):
+			self._partial_image_displayer(self.image, first_row // self.BANK_HEIGHT, last_row // self.BANK_HEIGHT)
+		else:
+			self._image_displayer(self.image)
+
+	def _get_widget_inputs(self, display_data):
+		"""@brief Compute the inputs of each widget, in drawing order
+
+		@return A list of tuples (widget key, inputs), widgets with identical inputs draw identical pixels
+		"""
+		widgets = [('power', display_data.displayed_power),
+		           ('separator', None),
+		           ('balance', display_data.pflow_str),
+		           ('title', display_data.read_error),
+		           ('icon', display_data.beat)]
+		(xleft, ytop, xright, ybottom) = self.graph_xyxy
+		width = xright - xleft
+		data = display_data.scaled_bar_graph[-self.lcd_width:]
+		data = data[:width]	# Crop data to the max width
+		vert_lines_freq = display_data.vert_lines_freq
+		for ofs in range(width):
+			if ofs < len(data):
+				time_marker = vert_lines_freq is not None and ((len(data) - ofs) % vert_lines_freq == 0)	# We should display a vertical line to represent time
+				widgets.append((ofs, (data[ofs], time_marker)))
+			else:
+				widgets.append((ofs, None))	# No data for this column yet
+		return widgets
+
+	def _get_widget_box(self, key, inputs):
+		"""@return The box (x0, y0, x1, y1) that will contain all pixels drawn by a widget, or None if it draws nothing
+		"""
+		if key == 'power':
+			(w, h) = self._big_text.get_size(str(inputs) + 'W')
+			return (0, self.top+4, w, self.top+4+h)
+		elif key == 'separator':
+			return (0, self.top+22, self.lcd_width+1, self.top+23)
+		elif key == 'balance':
+			if inputs is None:
+				return None
+			(w, h) = self._small_text.get_size('Bilan:' + inputs + 'W')
+			return (0, self.top+23, w, self.top+23+h)
+		elif key == 'title':
+			(w, h) = self._small_text.get_size(self._get_title(inputs))
+			return (0, self.top, w, self.top+h)
+		elif key == 'icon':
+			if not inputs:
+				return None
+			return (75, self.top+8, 75+self.ELEC_ICON_SIZE[0], self.top+8+self.ELEC_ICON_SIZE[1])
+		else:	# Graph column
+			if inputs is None:
+				return None
+			(xleft, ytop, xright, ybottom) = self.graph_xyxy
+			return (xleft+key, ytop-1, xleft+key+1, ybottom)
+
+	@staticmethod
+	def _get_title(read_error):
+		if not read_error:
+			return "Puissance soutiree"
 		else:
-			self.image_drawer.text((0, self.top), "Erreur lecture", font=self.font_small)
-		if display_data.beat:
-			self._draw_elec_icon((75, self.top+8))
-		self._draw_percentage_graph((0, self.top+31, self.lcd_width, self.lcd_height), display_data.scaled_bar_graph[-self.lcd_width:], vert_lines_freq=display_data.vert_lines_freq)
+			return "Erreur lecture"
+
+	def _draw_widget(self, key, inputs):
+		if key == 'power':
+			self._big_text.draw(self.image_drawer, (0, self.top+4), str(inputs) + 'W')
+		elif key == 'separator':
+			self.image_drawer.line((0, self.top+22, self.lcd_width, self.top+22), fill=0)
+		elif key == 'balance':
+			if inputs is not None:
+				self._small_text.draw(self.image_drawer, (0, self.top+23), 'Bilan:' + inputs + 'W')
+		elif key == 'title':
+			self._small_text.draw(self.image_drawer, (0, self.top), self._get_title(inputs))
+		elif key == 'icon':
+			if inputs:
+				self.image_drawer.bitmap((75, self.top+8), self._elec_icon, fill=0)
+		else:	# Graph column
+			if inputs is not None:
+				(value, time_marker) = inputs
+				self._draw_graph_column(self.graph_xyxy, key, value, time_marker)
+
+	@staticmethod
+	def _boxes_intersect(box1, box2):
+		return box1[0] < box2[2] and box2[0] < box1[2] and box1[1] < box2[3] and box2[1] < box1[3]
+
+	def draw_to_image(self, display_data):
+		"""@brief Update the image with new data, only redrawing what changed
+
+		@param display_data The DisplayData to draw
+		@return A tuple (first row, last row) containing the rows modified in the image, or None if the image did not change
+		"""
+		widgets = self._get_widget_inputs(display_data)
+		redrawn = set()
+		cleared_boxes = []
+		for (key, inputs) in widgets:
+			if key in self._widget_inputs and self._widget_inputs[key] == inputs:
+				continue
+			redrawn.add(key)
+			old_box = self._widget_boxes.get(key)
+			if old_box is not None:
+				cleared_boxes.append(old_box)
+			new_box = self._get_widget_box(key, inputs)
+			if new_box is not None:
+				cleared_boxes.append(new_box)
+			self._widget_inputs[key] = inputs
+			self._widget_boxes[key] = new_box
+		if not redrawn:
+			return None
+		# Clearing a box also erases the widgets overlapping it, so they must be redrawn too (and their own box cleared)
+		nb_checked_boxes = 0
+		while nb_checked_boxes < len(cleared_boxes):
+			box = cleared_boxes[nb_checked_boxes]
+			nb_checked_boxes += 1
+			for (key, inputs) in widgets:
+				widget_box = self._widget_boxes[key]
+				if key not in redrawn and widget_box is not None and self._boxes_intersect(widget_box, box):
+					redrawn.add(key)
+					cleared_boxes.append(widget_box)
+		for box in cleared_boxes:
+			self.image_drawer.rectangle((box[0], box[1], box[2]-1, box[3]-1), outline=255, fill=255)
+		for (key, inputs) in widgets:	# Redraw in the same order as a full drawing, so overlapping pixels are identical
+			if key in redrawn:
+				self._draw_widget(key, inputs)
+		first_row = max(0, min([box[1] for box in cleared_boxes]))
+		last_row = min(self.lcd_height, max([box[3] for box in cleared_boxes])) - 1
+		if self._dirty_rows is not None:	# Previous modifications have not been displayed yet
+			first_row = min(first_row, self._dirty_rows[0])
+			last_row = max(last_row, self._dirty_rows[1])
+		self._dirty_rows = (first_row, last_row)
+		return (first_row, last_row)
 
-	def _draw_percentage_graph(self, xyxy, data, vert_lines_freq=None):
+	def _draw_graph_column(self, xyxy, ofs, value, time_marker):
+		"""@brief Draw one bar of the percentage graph
+
+		@param xyxy The box of the whole graph
+		@param ofs The column offset inside the graph
+		@param value The bar height in percent, or None if there is no value
+		@param time_marker True if a vertical line representing time should be displayed on this column
+		"""
 		assert isinstance(xyxy, tuple)
 		(xleft, ytop, xright, ybottom) = xyxy
 		x = xleft
 		y = ytop
 		height = ybottom - ytop
-		width = xright - xleft
 		assert x == 0
-		# Crop data to the max width
-		data = data[:width]
-		ofs = 0
 		bottom_y = y+height-1
-		for value in data:
+		if value is None:
+			bar_sz = 0
+		else:
 			bar_sz = value * height // 100	# Scale the percentage to the height
 			self.image_drawer.line((x+ofs, bottom_y-bar_sz, x+ofs, bottom_y), fill=0)
-			if vert_lines_freq is not None and ((len(data) - ofs) % vert_lines_freq == 0):	# We should display a vertical line to represent time
-				print('len(data)=' + str(len(data)) + ', ofs=' + str(ofs) + '=>displaying a time marker (freq is ' + str(vert_lines_freq))
-				if bar_sz > height//2:	# Bar is higher than 50%, draw a white line at the bottom
-					self.image_drawer.line((x+ofs, bottom_y-bar_sz+2, x+ofs, bottom_y), fill=255)
-				else:
-					self.image_drawer.line((x+ofs, y, x+ofs, bottom_y-bar_sz-2), fill=0)
-			ofs += 1
+		if time_marker:
+			if bar_sz > height//2:	# Bar is higher than 50%, draw a white line at the bottom
+				self.image_drawer.line((x+ofs, bottom_y-bar_sz+2, x+ofs, bottom_y), fill=255)
+			else:
+				self.image_drawer.line((x+ofs, y, x+ofs, bottom_y-bar_sz-2), fill=0)
 
-	def _draw_elec_icon(self, xy):
+	@staticmethod
+	def _draw_elec_icon(image_drawer, xy, fill=0):
 		assert isinstance(xy, tuple)
 		(x, y) = xy
-		self.image_drawer.line((x, y, x+5, y+5), fill=0)
-		self.image_drawer.line((x+5, y+5, x, y+5), fill=0)
-		self.image_drawer.line((x, y+5, x+5, y+10), fill=0)
-		self.image_drawer.line((x+5, y+10, x+2, y+10), fill=0)
-		self.image_drawer.line((x+5, y+10, x+5, y+7), fill=0)
+		image_drawer.line((x, y, x+5, y+5), fill=fill)
+		image_drawer.line((x+5, y+5, x, y+5), fill=fill)
+		image_drawer.line((x, y+5, x+5, y+10), fill=fill)
+		image_drawer.line((x+5, y+10, x+2, y+10), fill=fill)
+		image_drawer.line((x+5, y+10, x+5, y+7), fill=fill)
+
+LCD_WIDTH = 84	# Resolution of the PCD8544 LCD (Nokia 5110)
+LCD_HEIGHT = 48
+
+def image_to_banks(image, first_bank=0, last_bank=None):
+	"""@brief Convert rows of a mode '1' image to the PCD8544 memory layout
+
+	Each byte represents 8 vertical pixels of a bank (bit 0 being the top row, a set bit being a black pixel), and banks are stored one after the other.
+
+	@param image The image
+	@param first_bank The first bank to convert
+	@param last_bank The last bank to convert (inclusive), or None for the last bank of the image
+	@return The converted banks, as a bytearray of image width bytes per bank
+	"""
+	(width, height) = image.size
+	if last_bank is None:
+		last_bank = (height - 1) // LCDDisplay.BANK_HEIGHT
+	pixels = image.load()
+	banks = bytearray(width * (last_bank - first_bank + 1))
+	pos = 0
+	for bank in range(first_bank, last_bank+1):
+		top = bank * LCDDisplay.BANK_HEIGHT
+		bank_height = min(LCDDisplay.BANK_HEIGHT, height - top)
+		for x in range(width):
+			bits = 0
+			for bit in range(bank_height):
+				if pixels[x, top+bit] == 0:
+					bits |= 1 << bit
+			banks[pos] = bits
+			pos += 1
+	return banks
+
+class NullDisplayBackend:
+	"""@brief Display backend discarding images (eg: to profile drawing without any display)
+
+	Backends provide display_image() and display_banks(), to be used as the image_displayer and partial_image_displayer of an LCDDisplay.
+	"""
+	def __init__(self):
+		self.nb_images = 0
+
+	def display_image(self, image):
+		self.nb_images += 1
+
+	def display_banks(self, image, first_bank, last_bank):
+		self.nb_images += 1
+
+class FileDisplayBackend:
+	"""@brief Display backend writing each image to a PNG or PBM file (the format is taken from the file extension)
+
+	The file is replaced atomically, so that readers never see a partially written image.
+	"""
+	def __init__(self, path):
+		"""@brief Constructor
+
+		@param path The image file to write
+		"""
+		self.path = path
+		self.format = 'PPM' if path.lower().endswith('.pbm') else 'PNG'	# PIL writes mode '1' images to PBM files with its PPM encoder
+		self.nb_images = 0
+
+	def display_image(self, image):
+		temporary_path = self.path + '.tmp'
+		image.save(temporary_path, format=self.format)
+		os.rename(temporary_path, self.path)
+		self.nb_images += 1
+
+	def display_banks(self, image, first_bank, last_bank):
+		self.display_image(image)
+
+class PCD8544BankWriter:
+	"""@brief Send some banks of a PCD8544 LCD, using the internals of an Adafruit_Nokia_LCD.PCD8544 instance
+
+	The Adafruit library can only send the whole screen, so we directly use its buffer and GPIO/SPI objects here.
+	As these are private, their presence is checked once: use is_supported() before write_banks().
+	"""
+	REQUIRED_ATTRIBUTES = ('_buffer', '_gpio', '_dc', '_spi', 'command')
+	REQUIRED_CONSTANTS = ('PCD8544_SETYADDR', 'PCD8544_SETXADDR')
+
+	def __init__(self, disp):
+		"""@brief Constructor
+
+		@param disp An initialized Adafruit_Nokia_LCD.PCD8544 instance
+		"""
+		self.disp = disp
+		missing = [name for name in self.REQUIRED_ATTRIBUTES if not hasattr(disp, name)]
+		missing += [name for name in self.REQUIRED_CONSTANTS if not hasattr(LCD, name)]
+		self.missing = missing	# Names not found in the library, partial updates are not possible if this is not empty
+
+	def is_supported(self):
+		return not self.missing
+
+	def write_banks(self, banks, first_bank, width):
+		"""@brief Update the library buffer and send consecutive banks to the LCD
+
+		@param banks The converted banks (see image_to_banks())
+		@param first_bank The index of the first bank in banks
+		@param width The number of bytes per bank
+		"""
+		disp = self.disp
+		disp._buffer[first_bank*width:first_bank*width+len(banks)] = banks
+		disp.command(LCD.PCD8544_SETYADDR | first_bank)
+		disp.command(LCD.PCD8544_SETXADDR)	# Column 0, the address then auto-increments across banks
+		disp._gpio.set_high(disp._dc)
+		disp._spi.write(disp._buffer[first_bank*width:first_bank*width+len(banks)])
+
+class PCD8544DisplayBackend:
+	"""@brief Display backend driving a PCD8544 LCD (Nokia 5110) through the Adafruit_Nokia_LCD library
+	"""
+	def __init__(self, disp):
+		"""@brief Constructor
+
+		@param disp An initialized Adafruit_Nokia_LCD.PCD8544 instance
+		"""
+		self.disp = disp
+		self._bank_writer = PCD8544BankWriter(disp)
+		if not self._bank_writer.is_supported():	# Eg: the library internals changed, always send the whole screen
+			log.emit('WARNING', 'lcd_partial_update_unsupported', min_interval=0, missing=','.join(self._bank_writer.missing))
+			self._bank_writer = None
+
+	def display_image(self, image):
+		self.disp.image(image)
+		self.disp.display()
+
+	def display_banks(self, image, first_bank, last_bank):
+		"""@brief Only convert and send the PCD8544 banks first_bank to last_bank (or the whole screen if the library does not allow it)
+		"""
+		if self._bank_writer is None:
+			self.display_image(image)
+			return
+		self._bank_writer.write_banks(image_to_banks(image, first_bank, last_bank), first_bank, image.size[0])
+
+class HTTPDisplayBackend(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	"""@brief Display backend serving the latest image over HTTP, to any number of viewers
+
+	Each displayed image gets a sequence number, and is converted once to the PCD8544 bank layout. Requests:
+	- GET /frame.png and /frame.pbm: the latest image (encoded once per image, whatever the number of viewers)
+	- GET /delta?since=<seq>: the banks that changed since image seq (see get_delta())
+	- GET /status.json: a JSON document with the sequence number, the geometry, and the values returned by the status provider
+
+	Like MetricsHTTPServer, requests are served in their own threads (see start()), so that a slow viewer never holds up decoding nor the display.
+	"""
+	daemon_threads = True	# Pending requests do not prevent exiting
+	DELTA_HEADER = struct.Struct('<IB')	# Sequence number of the image, number of banks that follow (each bank is preceeded by its index)
+	MAX_DELTA_HISTORY = 32	# Number of past images for which deltas can be computed, older viewers get all banks
+
+	class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+		timeout = 2	# Idle clients do not keep their thread forever
+
+		def do_GET(self):
+			server = self.server
+			path = self.path.split('?', 1)[0]
+			if path == '/frame.png':
+				(content_type, body) = ('image/png', server.get_encoded_image('PNG'))
+			elif path == '/frame.pbm':
+				(content_type, body) = ('image/x-portable-bitmap', server.get_encoded_image('PPM'))
+			elif path == '/delta':
+				since = None
+				for parameter in self.path.partition('?')[2].split('&'):
+					if parameter.startswith('since='):
+						try:
+							since = int(parameter[len('since='):])
+						except ValueError:
+							pass
+				(content_type, body) = ('application/octet-stream', server.get_delta(since))
+			elif path == '/status.json':
+				(content_type, body) = ('application/json', server.get_status_json())
+			else:
+				self.send_error(404)
+				return
+			if body is None:	# Nothing displayed yet
+				self.send_error(503)
+				return
+			self.send_response(200)
+			self.send_header('Content-Type', content_type)
+			self.send_header('Content-Length', str(len(body)))
+			self.send_header('Cache-Control', 'no-cache')
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass	# No console output for each request
+
+	def __init__(self, port=8043, address='127.0.0.1', status_provider=None):
+		"""@brief Listen for HTTP requests
+
+		@param port The TCP port to listen on
+		@param address The address to listen on (local only by default)
+		@param status_provider An optional function returning a dict of values to add to the JSON status document
+		"""
+		BaseHTTPServer.HTTPServer.__init__(self, (address, port), HTTPDisplayBackend.RequestHandler)
+		self.status_provider = status_provider
+		self._lock = threading.Lock()	# Protects the latest image, shared between the display and the request threads
+		self.image = None
+		self.seq = 0
+		self._banks_history = collections.deque(maxlen=self.MAX_DELTA_HISTORY)	# Tuples (seq, banks) of the latest images
+		self._encoded_images = {}	# Latest image encoded in each format
+
+	def display_image(self, image):
+		self.display_banks(image, 0, (image.size[1] - 1) // LCDDisplay.BANK_HEIGHT)
+
+	def display_banks(self, image, first_bank, last_bank):
+		if self._banks_history:
+			banks = bytearray(self._banks_history[-1][1])
+			width = image.size[0]
+			banks[first_bank*width:(last_bank+1)*width] = image_to_banks(image, first_bank, last_bank)	# Only the modified banks are converted
+		else:
+			banks = image_to_banks(image)
+		image = image.copy()
+		with self._lock:
+			self.seq += 1
+			self.image = image
+			self._banks_history.append((self.seq, bytes(banks)))
+			self._encoded_images = {}
+
+	def start(self):
+		"""@brief Serve requests in a background thread
+		"""
+		thread = threading.Thread(target=self.serve_forever, name='display-http')
+		thread.daemon = True
+		thread.start()
+
+	def get_encoded_image(self, image_format):
+		"""@return The latest image encoded in a PIL format ('PNG' or 'PPM'), or None if no image was displayed yet
+		"""
+		with self._lock:	# Encoding a 84x48 image is fast enough to be done while holding the lock
+			if self.image is None:
+				return None
+			encoded = self._encoded_images.get(image_format)
+			if encoded is None:
+				output = io.BytesIO()
+				self.image.save(output, format=image_format)
+				encoded = output.getvalue()
+				self._encoded_images[image_format] = encoded
+			return encoded
+
+	def get_delta(self, since=None):
+		"""@brief Get the banks that changed since a previous image
+
+		@param since The sequence number of the image the viewer has, or None to get all banks
+		@return The sequence number of the latest image and its number of changed banks (see DELTA_HEADER), followed by the index and bytes of each changed bank, or None if no image was displayed yet
+		"""
+		with self._lock:
+			if not self._banks_history:
+				return None
+			(seq, banks) = self._banks_history[-1]
+			previous_banks = None
+			for (previous_seq, candidate) in self._banks_history:
+				if previous_seq == since:
+					previous_banks = candidate
+					break
+			width = self.image.size[0]
+		changed = []
+		for bank in range(len(banks) // width):
+			bank_bytes = banks[bank*width:(bank+1)*width]
+			if previous_banks is None or previous_banks[bank*width:(bank+1)*width] != bank_bytes:
+				changed.append(struct.pack('<B', bank) + bank_bytes)
+		return self.DELTA_HEADER.pack(seq, len(changed)) + b''.join(changed)
+
+	def get_status_json(self):
+		status = collections.OrderedDict()
+		with self._lock:
+			status['seq'] = self.seq
+			status['width'] = LCD_WIDTH if self.image is None else self.image.size[0]
+			status['height'] = LCD_HEIGHT if self.image is None else self.image.size[1]
+		if self.status_provider is not None:
+			status.update(dict(self.status_provider()))	# Copied at once, as the provided values are updated by the decoding thread
+		return json.dumps(status).encode('ascii')
+
+class DisplayScheduler:
+	"""@brief Decide when DisplayData updates are drawn and pushed to the LCD
+
+	Updates submitted between two refreshes are coalesced (only the newest one is drawn), updates identical to what is already displayed are skipped,
+	and the refresh interval grows when drawing and pushing become slow, so that the display never uses more than about half of the time.
+	"""
+	def __init__(self, display, target_fps=2, max_staleness=2.0, metrics=None):
+		"""@brief Constructor
+
+		@param display The LCDDisplay to draw to
+		@param target_fps The maximum number of refreshes per second
+		@param max_staleness The maximum time (in seconds) a pending update may wait, even when refreshes are slow
+		@param metrics An optional MetricsRegistry, in which refresh durations, latencies and skipped updates are reported
+		"""
+		self.display = display
+		self.min_interval = 1.0 / target_fps
+		self.max_staleness = max_staleness
+		self._pending = None	# Tuple (frame time, DisplayData) waiting to be displayed
+		self._displayed = None	# DisplayData on the LCD
+		self._last_refresh_time = None
+		self.avg_refresh_duration = 0	# Exponential moving average of draw and push durations (in seconds)
+		self.nb_refreshes = 0
+		self.nb_coalesced = 0	# Updates replaced by a newer one before being displayed
+		self.nb_identical = 0	# Updates skipped because they would not change the LCD
+		self._refresh_histogram = None
+		self._push_histogram = None
+		self._latency_histogram = None
+		if metrics is not None:
+			self._refresh_histogram = metrics.add_histogram('lcd_refresh_seconds')	# Drawing and pushing
+			self._push_histogram = metrics.add_histogram('lcd_push_seconds')	# Pushing only (eg: SPI transfer to the LCD)
+			self._latency_histogram = metrics.add_histogram('frame_to_lcd_seconds')	# From the reception of a frame to the end of the LCD update
+			metrics.add_gauge('lcd_refreshes', lambda: self.nb_refreshes)
+			metrics.add_gauge('lcd_coalesced_updates', lambda: self.nb_coalesced)
+			metrics.add_gauge('lcd_identical_updates', lambda: self.nb_identical)
+
+	def submit(self, display_data, frame_time=None):
+		"""@brief Request a new DisplayData to be displayed
+
+		@param display_data The DisplayData
+		@param frame_time The reception time of the frame the data comes from (now by default)
+		"""
+		if frame_time is None:
+			frame_time = time.time()
+		if self._pending is not None:
+			self.nb_coalesced += 1
+		self._pending = (frame_time, display_data)
+
+	def get_refresh_interval(self):
+		"""@return The current minimum interval between two refreshes (in seconds)
+		"""
+		return min(max(self.min_interval, 2 * self.avg_refresh_duration), self.max_staleness)
+
+	def run_pending(self):
+		"""@brief Refresh the LCD if an update is pending and the refresh interval has elapsed (to be run with TICPipeline.add_timer())
+
+		@return The delay (in seconds) before the pending update is due, or None if there is no pending update
+		"""
+		if self._pending is None:
+			return None
+		now = time.time()
+		if self._last_refresh_time is not None:
+			delay = self._last_refresh_time + self.get_refresh_interval() - now
+			if delay > 0:
+				return delay
+		(frame_time, display_data) = self._pending
+		self._pending = None
+		if display_data == self._displayed:
+			self.nb_identical += 1
+			return None
+		refresh_start = timeit.default_timer()
+		self.display.draw_to_image(display_data=display_data)
+		push_start = timeit.default_timer()
+		self.display.display()
+		refresh_end = timeit.default_timer()
+		refresh_duration = refresh_end - refresh_start
+		self._displayed = display_data
+		self._last_refresh_time = now
+		self.nb_refreshes += 1
+		if self.nb_refreshes == 1:
+			self.avg_refresh_duration = refresh_duration
+		else:
+			self.avg_refresh_duration += (refresh_duration - self.avg_refresh_duration) / 8.0
+		if self._refresh_histogram is not None:
+			self._refresh_histogram.observe(refresh_duration)
+			self._push_histogram.observe(refresh_end - push_start)
+			self._latency_histogram.observe(time.time() - frame_time)
+		return None
 
 def evaluate_power_flow(current, voltage, is_injecting):
 	"""@brief Try to guess a range containing the current power flow (positive=withdrawn from the grid, negative=injected on the grid)
@@ -407,9 +3046,9 @@ def evaluate_power_flow(current, voltage, is_injecting):
 	@param voltage The instantaneous rms voltage
 	@param is_injecting True if we are injecting to the grid
 	"""
-	pflow_min = (irms+0.5) * urms
-	pflow_max = (irms-0.5) * urms
-	if inject:
+	pflow_min = (current+0.5) * voltage
+	pflow_max = (current-0.5) * voltage
+	if is_injecting:
 		(pflow_min, pflow_max) = (-pflow_min, -pflow_max)	# Negative values when injecting
 	if pflow_min>pflow_max:
 		(pflow_min, pflow_max) = (pflow_max, pflow_min)
@@ -417,65 +3056,101 @@ def evaluate_power_flow(current, voltage, is_injecting):
 	return (pflow_str, pflow_min, pflow_max)
 
 if __name__ == "__main__":
-	print('Starting...')
-	# Raspberry Pi software SPI config:
-	SCLK = 17
-	DIN = 18
-	DC = 27
-	RST = 23
-	CS = 22
+	parser = argparse.ArgumentParser(description='Display the power measured by a Linky meter')
+	parser.add_argument('--port', default='/dev/ttyUSB0', help='Serial device connected to the meter')
+	parser.add_argument('--backend', choices=['lcd', 'null', 'file', 'http'], default='lcd', help='Where to display: the PCD8544 LCD, nowhere, an image file, or a local HTTP server')
+	parser.add_argument('--output', default='linky.png', help='Image file written by the file backend (.png or .pbm)')
+	parser.add_argument('--http-port', type=int, default=8043, help='TCP port of the http backend')
+	args = parser.parse_args()
 
-	# Software SPI usage (defaults to bit-bang SPI interface):
-	disp = LCD.PCD8544(DC, RST, SCLK, DIN, CS)
+	print('Starting...')
+	status = {}	# Latest displayed values, published by the http backend
+	if args.backend == 'lcd':
+		if LCD is None:
+			raise ImportError('Adafruit_Nokia_LCD is required to drive the LCD display')
+		# Raspberry Pi software SPI config:
+		SCLK = 17
+		DIN = 18
+		DC = 27
+		RST = 23
+		CS = 22
 
-	# Initialize library.
-	disp.begin(contrast=60)
+		# Software SPI usage (defaults to bit-bang SPI interface):
+		disp = LCD.PCD8544(DC, RST, SCLK, DIN, CS)
 
-	# Clear display.
-	disp.clear()
-	disp.display()
+		# Initialize library.
+		disp.begin(contrast=60)
 
-	def image_displayer(image):
-		disp.image(image)
+		# Clear display.
+		disp.clear()
 		disp.display()
+		display_backend = PCD8544DisplayBackend(disp)
+	elif args.backend == 'null':
+		display_backend = NullDisplayBackend()
+	elif args.backend == 'file':
+		display_backend = FileDisplayBackend(args.output)
+	else:
+		display_backend = HTTPDisplayBackend(port=args.http_port, status_provider=lambda: status)	# Viewers can read http://127.0.0.1:8043/frame.png
 
-	display_driver = LCDDisplay(image_displayer=image_displayer,
-	                            lcd_width=LCD.LCDWIDTH, lcd_height=LCD.LCDHEIGHT, top=-1,
+	display_driver = LCDDisplay(image_displayer=display_backend.display_image,
+	                            lcd_width=LCD_WIDTH, lcd_height=LCD_HEIGHT, top=-1,
 	                            font_small=ImageFont.truetype('DejaVuSans.ttf', 8),
-	                            font_big=ImageFont.truetype('DejaVuSans.ttf', 18))
+	                            font_big=ImageFont.truetype('DejaVuSans.ttf', 18),
+	                            partial_image_displayer=display_backend.display_banks)
 
-	phy = PhyDecoder(baudrate=9600, port="/dev/ttyUSB0")
+	DISPLAYED_LABELS = {True: ('SINSTS', 'IRMS1', 'URMS1'), False: ('PAPP', 'IINST', None)}	# Power, current and voltage labels in each TIC mode ("TIC historique" has no voltage)
+	phy = PhyDecoder(baudrate=9600, port=args.port)	# Non-blocking, the pipeline waits for incoming bytes itself
 	link_decoder = TICLinkLayerDecoder(phy)
-	tic_frames = TICFrames(tic_link_frame_fetcher=link_decoder.get_next_frame, standard_tic_mode=True)
-	hist = FixedWidthHistoryBarGraph(width=LCD.LCDWIDTH, history_requested_size=60*15) # Collect an amount of historical power measurement in the lower graph
+	tic_frames = TICFrames(tic_link_frame_fetcher=None, standard_tic_mode=True, labels=dict((mode, [label for label in labels if label is not None]) for (mode, labels) in DISPLAYED_LABELS.items()))	# We only display these labels, the whitelist follows the detected mode
+	metrics = MetricsRegistry()
+	pipeline = TICPipeline(link_decoder, tic_frames, metrics=metrics)
+	mode_detector = TICModeDetector(link_decoder, tic_frames)
+	pipeline.set_frame_interceptor(mode_detector.intercept_frame)
+	print('Detecting TIC mode...')
+	mode_detector.start()	# Sets the baudrate and the mode of tic_frames once detected, frames are only decoded after that
+	metrics_server = MetricsHTTPServer(metrics)	# Metrics can be read with "curl http://127.0.0.1:8042/metrics"
+	metrics_server.start()
+	if isinstance(display_backend, HTTPDisplayBackend):
+		display_backend.start()
+	inter_frame_histogram = metrics.add_histogram('inter_frame_seconds')
+	history_store = TimeSeriesStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history'), labels=DISPLAYED_LABELS[True])	# "TIC historique" values are stored in the columns of their "TIC standard" equivalent
+
+	def store_frame(item):
+		(frame_time, frame) = item
+		history_store.append(frame_time, [None if label is None else frame.get(label) for label in DISPLAYED_LABELS[tic_frames.standard_tic_mode]])
+
+	pipeline.add_consumer('mode_detector', callback=mode_detector.frame_decoded, maxlen=16)
+	pipeline.add_timer(mode_detector.check_silence)
+	pipeline.add_consumer('store', callback=store_frame, maxlen=256)	# Disk writes never delay decoding, up to 256 frames are kept if the disk is slow
+	METRICS_LOG_INTERVAL = 60
+	next_metrics_log = [time.time() + METRICS_LOG_INTERVAL]	# In a list, so that log_metrics() can update it
+
+	def log_metrics():
+		"""@brief Log a summary of all metrics periodically (pipeline timer), so that it is only computed when printed
+		"""
+		now = time.time()
+		if now >= next_metrics_log[0]:
+			log.emit('INFO', 'metrics', min_interval=0, **metrics.get_values())
+			next_metrics_log[0] = now + METRICS_LOG_INTERVAL
+		return next_metrics_log[0] - now
+
+	pipeline.add_timer(log_metrics)
+	power_history = MultiResolutionHistory(width=LCD_WIDTH) # Collect an amount of historical power measurement in the lower graph (last 15 minutes by default)
+	print('Restored ' + str(history_store.restore_history(power_history, 'SINSTS')) + ' samples from history store')
 	beat = True
 	successive_sinsts_errors = 0
 	last_sinsts = -1
 	successive_null_sinsts = 0
 
-	display_queue = Queue.Queue()
+	display_scheduler = DisplayScheduler(display_driver, target_fps=2, max_staleness=2.0, metrics=metrics)	# Only the newest DisplayData is drawn when we are running late
+	pipeline.add_timer(display_scheduler.run_pending)
+	frame_queue = pipeline.add_consumer('main', maxlen=16)
 
-	def display_to_lcd(data_queue):
-		while True:
-			new_display_data = display_queue.get()
-			while not display_queue.empty():
-				print('Running late... discarding one display data')
-				display_queue.get()
-			display_driver.draw_to_image(display_data=new_display_data)
-			display_driver.display()
-
-	#display_thread = threading.Thread(target=display_to_lcd, args=(display_queue), daemon=True) # Only available on recent python versions
-	display_thread = threading.Thread(target=display_to_lcd, args=(display_queue,))
-	display_thread.start()
-
-	first_frame_time = datetime.datetime.now()
-	total_frames_received = 0
-	for frame in tic_frames:
-		total_frames_received += 1
-		total_frame_decode_duration_s = (datetime.datetime.now() - first_frame_time).total_seconds()
-		#print('Total frame decoding: ' + str(total_frame_decode_duration_s) + 's')
-		avg_inter_frame_period_ms = total_frame_decode_duration_s * 1000 / total_frames_received
-		print('Avg inter-frame period: ' + str(avg_inter_frame_period_ms) + 'ms')
+	last_frame_time = None
+	for (frame_time, frame) in pipeline.iter_items(frame_queue):
+		if last_frame_time is not None:
+			inter_frame_histogram.observe(frame_time - last_frame_time)
+		last_frame_time = frame_time
 		# Historical code to get current CPU temp (unused)
 		#with open("/sys/class/thermal/thermal_zone0/temp") as temp_f:
 		#	temp = float(temp_f.read()) / 1000.0
@@ -483,8 +3158,10 @@ if __name__ == "__main__":
 		read_error = False
 		power = None
 		new_switch_to_withdrawn_power = False
-		try:
-			last_sinsts=int(frame['SINSTS'])
+		(power_label, current_label, voltage_label) = DISPLAYED_LABELS[tic_frames.standard_tic_mode]
+		sinsts = frame.get(power_label)
+		if sinsts is not None:
+			last_sinsts = sinsts
 			power = last_sinsts
 			successive_sinsts_errors = 0
 			if last_sinsts == 0:
@@ -493,53 +3170,42 @@ if __name__ == "__main__":
 				if successive_null_sinsts > 10:
 					new_switch_to_withdrawn_power = True
 				successive_null_sinsts = 0
-		except Exception as e:
+		else:
 			successive_sinsts_errors += 1
 			read_error = True
-			tb = traceback.format_exc()
-			print(tb)
+			log.emit('ERROR', 'no_valid_sinsts')
 		# Power has an up-to-date value (and thus is not None) only if SINSTS read was successful
-		hist.append(power)	# Add the current reading (or None if reading failed)
-		(scaled_bar_graph, max_value) = list_scaled_to_percent(input=hist.to_fixed_width_list())
-		nb_frames_for_1_timescale_div = 5 * 60 * 1000 // avg_inter_frame_period_ms
-		print(str(nb_frames_for_1_timescale_div) + ' frames per 5 minutes')
-		bars_in_graph_for_1min = hist.get_nb_history_items_for_input_values(nb_frames_for_1_timescale_div)	# Get the number of measurements to covert 1 timescale division (as calculated above) in the current TIC mode
+		power_history.append(power, timestamp=frame_time)	# Add the current reading (or None if reading failed)
+		power_graph = power_history.get_view()
+		max_value = power_graph.max_value
+		scaled_bar_graph = tuple(power_graph.percent_bars)	# Snapshot of the displayed bars, as the display scheduler may draw them after more frames were appended
+		bars_in_graph_for_1min = power_history.get_time_marker_interval()	# Get the number of bars covering 1 timescale division in the current view
 		if new_switch_to_withdrawn_power:
-			prefix=TerminalColor.FAIL
-		else:
-			prefix=''
-		print(prefix + '(MAX=' + str(max_value) + 'W)' + str(scaled_bar_graph) + TerminalColor.ENDC)
+			log.emit('INFO', 'withdrawal_resumed', power=power)
 		displayed_power = power
 		if successive_sinsts_errors < 3:	# We keep drawing the previous SINST value until 2 successive errors
 			displayed_power = last_sinsts	# Set power to the last known power (old reading)
-		if successive_sinsts_errors == 0:
-			print('Power=' + str(displayed_power) + 'W')
 		pflow_str = None
-		irms = None
 		inject = (power == 0)
-		if not read_error:
-			try:
-				irms=int(frame['IRMS1'])
-				urms=int(frame['URMS1'])
+		if not read_error and voltage_label is not None:
+			irms = frame.get(current_label)
+			urms = frame.get(voltage_label)
+			if irms is not None and urms is not None:
 				(pflow_str, _, _) = evaluate_power_flow(current=irms, voltage=urms, is_injecting=inject)
-			except Exception as e:
+			else:
 				read_error = True
-				tb = traceback.format_exc()
-				print(tb)
-		if pflow_str is not None:
-			if irms is not None:
-				prefix=''
-				if irms == 0:	# We are around 0 injection, 0 withdrawn, use yellow
-					prefix=TerminalColor.WARNING
-				elif inject:
-					prefix=TerminalColor.OKGREEN
-				else:
-					prefix=TerminalColor.FAIL
-			print(prefix + 'Pflow=' + pflow_str + 'W' + TerminalColor.ENDC)
-
+				log.emit('ERROR', 'no_valid_irms1_urms1')
+		if successive_sinsts_errors == 0:
+			log.emit('INFO', 'power', power=displayed_power, pflow=pflow_str, max=max_value)
+		status['power'] = displayed_power
+		status['pflow'] = pflow_str
+		status['max'] = max_value
+		status['read_error'] = read_error
+		status['standard_tic_mode'] = tic_frames.standard_tic_mode
+		status['frame_time'] = frame_time
 
-		new_display_data = DisplayData(scaled_bar_graph=scaled_bar_graph, displayed_power=displayed_power, pflow_str=pflow_str, read_error=read_error, beat=beat, vert_lines_freq=bars_in_graph_for_1min)
-		display_queue.put_nowait(new_display_data)
+		new_display_data = DisplayData(scaled_bar_graph=scaled_bar_graph, displayed_power=displayed_power, pflow_str=pflow_str, read_error=read_error, beat=beat, vert_lines_freq=bars_in_graph_for_1min or None)
+		display_scheduler.submit(new_display_data, frame_time=frame_time)
 
 		if successive_sinsts_errors == 0:
 			beat = not beat
@@ -0,0 +1,263 @@
+#!/usr/bin/env python2.7
+import display_linky
+from bench_linky import percentile
+
+from PIL import ImageFont
+
+import argparse
+import os
+import pty
+import random
+import threading
+import time
+import tty
+
+"""
+Linky meter simulator, emitting TIC frames on a Linux pseudo-terminal
+
+Simulate a "TIC standard" meter with impairments, and print the pseudo-terminal to open with PhyDecoder(port=...):
+./tic_simulator.py --mode standard --noise 0.0001 --truncate 0.01 --lost-sync 0.01
+
+Stress the decoding pipeline at a much higher line rate than a real meter, and measure the latency from the last byte of each frame to the LCD image:
+./tic_simulator.py --mode standard --baudrate 1000000 --frames 5000 --measure
+"""
+
+class MeterSimulator:
+	"""@brief Simulated Linky meter, writing TIC frames to a pseudo-terminal
+	"""
+	BITS_PER_BYTE = 10	# 1 start bit, 7 data bits, 1 parity bit, 1 stop bit
+	CHUNK_SIZE = 16	# Bytes are delivered to the pseudo-terminal by chunks, like a USB serial adapter would
+	SEQUENCE_LABEL = {True: 'MSG1', False: 'MOTDETAT'}	# Label carrying the frame sequence number, for each TIC mode
+	POWER_LABEL = {True: 'SINSTS', False: 'PAPP'}	# Label carrying the apparent power, for each TIC mode
+
+	def __init__(self, standard_tic_mode, baudrate, frame_rate=None, noise=0, truncate=0, lost_sync=0, lost_sync_burst_size=64, seed=None):
+		"""@brief Open a pseudo-terminal
+
+		@param standard_tic_mode True to emit "TIC standard" frames, False for "TIC historique" frames
+		@param baudrate The simulated line rate (bytes are paced accordingly)
+		@param frame_rate The number of frames per second, or None to send frames back-to-back like a real meter
+		@param noise The probability for each byte to have one bit flipped
+		@param truncate The probability for each frame to be cut before its end (its ETX is lost)
+		@param lost_sync The probability for each frame to be preceeded by a burst of random bytes
+		@param lost_sync_burst_size The maximum size of a random bytes burst
+		@param seed An optional seed for the random generator, to replay the same scenario
+		"""
+		(self.master_fd, self.slave_fd) = pty.openpty()
+		tty.setraw(self.slave_fd)
+		self.port = os.ttyname(self.slave_fd)
+		self.standard_tic_mode = standard_tic_mode
+		self.baudrate = baudrate
+		self.frame_rate = frame_rate
+		self.noise = noise
+		self.truncate = truncate
+		self.lost_sync = lost_sync
+		self.lost_sync_burst_size = lost_sync_burst_size
+		self._encoder = display_linky.TICFrameEncoder(standard_tic_mode=standard_tic_mode)
+		self._random = random.Random(seed)
+		self._power = 1500
+		self._line_start_time = None
+		self._line_bits = 0	# Number of bits sent on the line since _line_start_time
+		self.nb_frames_sent = 0
+		self.nb_frames_truncated = 0
+		self.nb_lost_sync_bursts = 0
+		self.nb_corrupted_bytes = 0
+		self.frame_send_times = {}	# Time at which the last byte of each complete frame was written, indexed by sequence number
+
+	def close(self):
+		os.close(self.master_fd)
+		os.close(self.slave_fd)
+
+	def build_frame(self, seq):
+		"""@brief Build a frame with realistic labels and a randomly evolving power
+
+		@param seq The sequence number of the frame, written in SEQUENCE_LABEL
+		@return The encoded frame
+		"""
+		self._power = max(0, min(9000, self._power + self._random.randint(-200, 200)))
+		voltage = self._random.randint(225, 240)
+		current = self._power // voltage
+		now = time.localtime()
+		if self.standard_tic_mode:
+			horodate = ('E' if now.tm_isdst else 'H') + time.strftime('%y%m%d%H%M%S', now)
+			datasets = [('ADSC', '041876097258'), ('VTIC', '02'), ('DATE', horodate, ''),
+			            ('NGTF', '      BASE      '), ('LTARF', '      BASE      '),
+			            ('EAST', '%09d' % (12345678 + seq)), ('EASF01', '%09d' % (12345678 + seq)), ('EASF02', '000000000'),
+			            ('EASD01', '%09d' % (12345678 + seq)), ('EASD02', '000000000'),
+			            ('IRMS1', '%03d' % current), ('URMS1', '%03d' % voltage),
+			            ('PREF', '09'), ('PCOUP', '09'),
+			            ('SINSTS', '%05d' % self._power), ('SMAXSN', horodate, '%05d' % (self._power + 100)),
+			            ('UMOY1', horodate, '%03d' % voltage),
+			            ('STGE', '003A0001'), (self.SEQUENCE_LABEL[True], '%08d' % seq),
+			            ('PRM', '09876543210123'), ('RELAIS', '000'),
+			            ('NTARF', '01'), ('NJOURF', '00'), ('NJOURF+1', '00'), ('PJOURF+1', '00008001 NONUTILE NONUTILE')]
+		else:
+			datasets = [('ADCO', '041876097258'), ('OPTARIF', 'BASE'), ('ISOUSC', '45'),
+			            ('BASE', '%09d' % (12345678 + seq)), ('PTEC', 'TH..'),
+			            ('IINST', '%03d' % current), ('IMAX', '090'),
+			            ('PAPP', '%05d' % self._power), ('HHPHC', 'A'),
+			            (self.SEQUENCE_LABEL[False], '%06d' % (seq % 1000000))]
+		return self._encoder.encode_frame(datasets)
+
+	def _write(self, data):
+		"""@brief Write bytes to the pseudo-terminal, paced at the simulated line rate
+
+		Each chunk is written once its last byte would have been fully received on a real line
+		"""
+		now = time.time()
+		if self._line_start_time is None or self._line_start_time + float(self._line_bits) / self.baudrate < now:	# The line was idle, restart pacing from now
+			self._line_start_time = now
+			self._line_bits = 0
+		for chunk_start in range(0, len(data), self.CHUNK_SIZE):
+			chunk = data[chunk_start:chunk_start + self.CHUNK_SIZE]
+			self._line_bits += len(chunk) * self.BITS_PER_BYTE
+			delay = self._line_start_time + float(self._line_bits) / self.baudrate - time.time()
+			if delay > 0:
+				time.sleep(delay)
+			while chunk:
+				written = os.write(self.master_fd, chunk)
+				chunk = chunk[written:]
+
+	def _corrupt(self, frame):
+		"""@brief Apply random bit flips to a frame, according to the noise probability
+		"""
+		if self.noise == 0:
+			return frame
+		corrupted = bytearray(frame)
+		for pos in range(len(corrupted)):
+			if self._random.random() < self.noise:
+				corrupted[pos] ^= 1 << self._random.randint(0, 6)
+				self.nb_corrupted_bytes += 1
+		return bytes(corrupted)
+
+	def send_frame(self):
+		"""@brief Send the next frame, with random impairments
+		"""
+		seq = self.nb_frames_sent
+		self.nb_frames_sent += 1
+		if self._random.random() < self.lost_sync:
+			burst = bytearray(self._random.randint(0, 255) & 0x7F for _ in range(self._random.randint(1, self.lost_sync_burst_size)))
+			self._write(bytes(burst))
+			self.nb_lost_sync_bursts += 1
+		frame = self._corrupt(self.build_frame(seq))
+		if self._random.random() < self.truncate:
+			self._write(frame[:self._random.randint(1, len(frame) - 1)])
+			self.nb_frames_truncated += 1
+		else:
+			self._write(frame)
+			self.frame_send_times[seq] = time.time()
+
+	def run(self, nb_frames=None):
+		"""@brief Send frames forever (or a given number of frames)
+		"""
+		while nb_frames is None or self.nb_frames_sent < nb_frames:
+			frame_start_time = time.time()
+			self.send_frame()
+			if self.frame_rate:
+				delay = frame_start_time + 1.0 / self.frame_rate - time.time()
+				if delay > 0:
+					time.sleep(delay)
+
+class EndToEndProbe(threading.Thread):
+	"""@brief Thread decoding the simulator output with the real pipeline, down to the LCD image
+	"""
+	def __init__(self, port, standard_tic_mode, baudrate):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.standard_tic_mode = standard_tic_mode
+		self.link_decoder = display_linky.TICLinkLayerDecoder(display_linky.PhyDecoder(port=port, baudrate=baudrate, blocking=True))
+		self.power_label = MeterSimulator.POWER_LABEL[standard_tic_mode]
+		self.sequence_label = MeterSimulator.SEQUENCE_LABEL[standard_tic_mode]
+		self.tic_frames = display_linky.TICFrames(tic_link_frame_fetcher=self.link_decoder.get_next_frame,
+		                                          standard_tic_mode=standard_tic_mode,
+		                                          labels=[self.power_label, self.sequence_label])
+		self.history = display_linky.MultiResolutionHistory(width=84)
+		try:
+			(font_small, font_big) = (ImageFont.truetype('DejaVuSans.ttf', 8), ImageFont.truetype('DejaVuSans.ttf', 18))
+		except IOError:	# Font not installed, latency will be a bit lower than on the target
+			(font_small, font_big) = (ImageFont.load_default(), ImageFont.load_default())
+		self.display = display_linky.LCDDisplay(image_displayer=lambda image: None,
+		                                        lcd_width=84, lcd_height=48, top=-1,
+		                                        font_small=font_small, font_big=font_big)
+		self.nb_frames_received = 0
+		self.frame_display_times = {}	# Time at which the LCD image was ready for each frame, indexed by sequence number
+		self._stop_requested = threading.Event()
+
+	def stop(self):
+		"""@brief Request the thread to stop after the next received frame
+		"""
+		self._stop_requested.set()
+
+	def run(self):
+		beat = True
+		for frame in self.tic_frames:
+			if self._stop_requested.is_set():
+				break
+			self.nb_frames_received += 1
+			power = frame.get(self.power_label)
+			self.history.append(power, timestamp=time.time())
+			graph = self.history.get_view()
+			display_data = display_linky.DisplayData(scaled_bar_graph=tuple(graph.percent_bars), displayed_power=power, pflow_str=None,
+			                                         read_error=(power is None), beat=beat,
+			                                         vert_lines_freq=self.history.get_time_marker_interval() or None)
+			self.display.draw_to_image(display_data)
+			self.display.display()
+			seq = frame.get(self.sequence_label)
+			if seq is not None and seq.isdigit():
+				self.frame_display_times[int(seq)] = time.time()
+			beat = not beat
+
+def print_report(simulator, probe):
+	print('Sent %d frames (%d truncated, %d random bursts, %d corrupted bytes)' % (simulator.nb_frames_sent, simulator.nb_frames_truncated, simulator.nb_lost_sync_bursts, simulator.nb_corrupted_bytes))
+	tic_frames = probe.tic_frames
+	print('Received %d frames, %d resyncs, %d checksum errors, %d malformed datasets, %d invalid values' % (probe.nb_frames_received, probe.link_decoder.nb_resyncs, tic_frames.nb_checksum_errors, tic_frames.nb_malformed_datasets, tic_frames.nb_invalid_values))
+	latencies = []
+	for (seq, display_time) in probe.frame_display_times.items():
+		if not simulator.standard_tic_mode:	# Sequence numbers are truncated to 6 digits
+			seq = seq + (simulator.nb_frames_sent - 1 - seq) // 1000000 * 1000000
+		send_time = simulator.frame_send_times.get(seq)
+		if send_time is not None:
+			latencies.append(display_time - send_time)
+	latencies.sort()
+	nb_complete_frames = len(simulator.frame_send_times)
+	print('%d/%d complete frames displayed' % (len(latencies), nb_complete_frames))
+	if latencies:
+		print('Byte to LCD image latency: p50=%.1fms p99=%.1fms max=%.1fms' % (percentile(latencies, 50) * 1e3, percentile(latencies, 99) * 1e3, latencies[-1] * 1e3))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Linky meter simulator on a pseudo-terminal')
+	parser.add_argument('--mode', choices=['standard', 'historique'], default='standard', help='TIC mode of the simulated meter')
+	parser.add_argument('--baudrate', type=int, help='Simulated line rate (9600 in "TIC standard", 1200 in "TIC historique" by default)')
+	parser.add_argument('--rate', type=float, help='Frames per second (by default, frames are sent back-to-back like a real meter)')
+	parser.add_argument('--noise', type=float, default=0, help='Probability for each byte to have one bit flipped')
+	parser.add_argument('--truncate', type=float, default=0, help='Probability for each frame to be cut before its end')
+	parser.add_argument('--lost-sync', type=float, default=0, help='Probability for each frame to be preceeded by a burst of random bytes')
+	parser.add_argument('--burst-size', type=int, default=64, help='Maximum size of random bytes bursts')
+	parser.add_argument('--frames', type=int, help='Number of frames to send (forever by default)')
+	parser.add_argument('--seed', type=int, help='Seed of the random generator')
+	parser.add_argument('--measure', action='store_true', help='Decode the frames in this process, and report the end-to-end latency')
+	args = parser.parse_args()
+
+	standard_tic_mode = (args.mode == 'standard')
+	baudrate = args.baudrate
+	if baudrate is None:
+		baudrate = 9600 if standard_tic_mode else 1200
+	simulator = MeterSimulator(standard_tic_mode=standard_tic_mode, baudrate=baudrate, frame_rate=args.rate,
+	                           noise=args.noise, truncate=args.truncate, lost_sync=args.lost_sync, lost_sync_burst_size=args.burst_size,
+	                           seed=args.seed)
+	print('Simulated meter on ' + simulator.port)
+	probe = None
+	if args.measure:
+		probe = EndToEndProbe(port=simulator.port, standard_tic_mode=standard_tic_mode, baudrate=baudrate)
+		probe.start()
+	try:
+		simulator.run(nb_frames=args.frames)
+		if probe is not None:
+			time.sleep(1)	# Let the last frames go through the pipeline
+	except KeyboardInterrupt:
+		pass
+	if probe is not None:
+		print_report(simulator, probe)
+		probe.stop()
+		simulator.send_frame()	# Wake up the probe thread, blocked waiting for bytes
+		probe.join(1)
+	simulator.close()